@@ -1,9 +1,14 @@
 from aqt.qt import *
 from aqt import mw, gui_hooks
+from aqt.browser import Browser
 from aqt.editor import EditorWebView, Editor
 
-from .forms import dict_ui
-from .cedict.main import start_main
+from .cedict.timing import timed
+
+with timed("import"):
+    from .forms import dict_ui
+    from .cedict.main import connections, fill_selected_notes, start_main
+    from .cedict.config import tags_changed
 
 mw.dictionary = None
 
@@ -45,6 +50,20 @@ def card_review_init_ctrl_s_hotkey():
         mw.dictionary.search_text(selected_text)
 
 
+def browser_menus_did_init(browser: Browser):
+    fill_action = QAction("Fill in Pinyin and English from CC-CEDICT", browser)
+    fill_action.triggered.connect(lambda: fill_selected_notes(browser))
+    browser.form.menu_Notes.addAction(fill_action)
+
+
+def profile_will_close():
+    # The dictionary connections are opened again on demand when the next profile is loaded
+    if mw.dictionary:
+        mw.dictionary.shutdown()
+        mw.dictionary = None
+    connections.close_all()
+
+
 action = QAction("CC-CEDICT for Anki", mw)
 action.triggered.connect(open_dict)
 mw.form.menuTools.addAction(action)
@@ -52,6 +71,9 @@ action.setShortcut(QKeySequence("Alt+D"))
 
 gui_hooks.editor_did_load_note.append(init_note)
 gui_hooks.editor_web_view_did_init.append(editor_init_ctrl_s_hotkey)
+gui_hooks.operation_did_execute.append(tags_changed)
+gui_hooks.profile_will_close.append(profile_will_close)
+gui_hooks.browser_menus_did_init.append(browser_menus_did_init)
 
 
 mw.ctrl_s_hotkey = QShortcut(QKeySequence("Alt+S"), mw)
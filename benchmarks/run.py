@@ -0,0 +1,263 @@
+"""
+Headless benchmarks of the dictionary build and the search, batch search, duplicate check and script detection
+paths, on synthetic CC-CEDICT files of several sizes. Anki and Qt are replaced by stubs, see stubs.py.
+
+    python benchmarks/run.py --sizes 10000 120000 1000000 --output results.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from os.path import abspath, dirname, exists, join
+from typing import Any, Callable, Dict, List
+
+import stubs
+import synthetic
+
+root = dirname(dirname(abspath(__file__)))
+package = stubs.load_addon(root)
+lookup = importlib.import_module(f"{package}.cedict.lookup")
+notes = importlib.import_module(f"{package}.cedict.notes")
+search = importlib.import_module(f"{package}.cedict.search")
+cache = importlib.import_module(f"{package}.cedict.cache")
+connections = importlib.import_module(f"{package}.cedict.connections")
+engine = importlib.import_module(f"{package}.cedict.engine")
+hanzidentifier = importlib.import_module(f"{package}.third_party.hanzidentifier.hanzidentifier")
+
+# Queries per lookup benchmark
+QUERIES = 200
+BATCH_WORDS = 1000
+DUPLICATE_CANDIDATES = 1000
+IDENTIFY_STRINGS = 100000
+
+FIELDS = ["Simplified", "Traditional", "Pinyin", "English"]
+
+
+def measure(fn: Callable[[], Any], repeat: int, ops: int) -> Dict[str, Any]:
+    """
+    Time a workload several times.
+
+    :param fn: runs the workload once
+    :param repeat: the number of runs
+    :param ops: the number of operations in one run, e.g. queries
+    :return: the minimum and median time of a run in seconds, and the median time per operation in microseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {"ops": ops, "repeat": repeat, "min_s": min(times), "median_s": median, "per_op_us": median / ops * 1e6}
+
+
+def build(source: str, directory: str) -> Dict[str, Any]:
+    """
+    Build the database from a CC-CEDICT file with tools/database.py, in a separate process like a release build.
+    """
+    os.makedirs(directory, exist_ok=True)
+    db_path = join(directory, "CC-CEDICT_dictionary.db")
+    if exists(db_path):
+        os.remove(db_path)
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, join(root, "tools", "database.py"), source], cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit status {process.returncode}"}
+    return {
+        "ops": 1,
+        "repeat": 1,
+        "min_s": elapsed,
+        "median_s": elapsed,
+        "per_op_us": elapsed * 1e6,
+        "db_bytes": os.path.getsize(db_path),
+        "bin_bytes": os.path.getsize(engine.binary_path(db_path)),
+    }
+
+
+def sample_queries(conn: sqlite3.Connection, rng: random.Random) -> Dict[str, List[str]]:
+    rows = conn.execute("SELECT hanzi_simp, pinyin, eng FROM dictionary").fetchall()
+    picked = [rng.choice(rows) for _ in range(QUERIES)]
+    return {
+        "hanzi": [row[0] for row in picked],
+        "prefix": [row[0][:1] + "*" for row in picked],
+        "pinyin": [row[1] for row in picked],
+        "english": [row[2].split(", ")[0] for row in picked],
+        "missing": ["".join(rng.choice("éü") for _ in range(3)) + str(i) for i in range(QUERIES)],
+    }
+
+
+def search_benchmarks(db_path: str, backend: str, queries: Dict[str, List[str]], repeat: int) -> Dict[str, Any]:
+    """
+    Single word searches through the search worker, run on the calling thread with the cache disabled.
+    Opening the dictionary is timed too, the file is likely in the page cache already.
+    """
+    manager = connections.ConnectionManager(db_path, backend)
+    worker = search.SearchWorker(manager, cache.QueryCache(db_path, 0, 0), *[lambda *args: None] * 4)
+    results = {f"{backend}.open": measure(lambda: engine.open_engine(db_path, backend).close(), repeat, 1)}
+    worker.engine = manager.engine()
+    ids = iter(range(1 << 62))
+
+    def run(words: List[str], exact: bool):
+        for word in words:
+            job = search.SearchJob(next(ids), [word], exact, True)
+            worker.latest = job.id
+            worker.run_job(job)
+
+    for kind, words in queries.items():
+        results[f"{backend}.match.{kind}"] = measure(lambda: run(words, False), repeat, len(words))
+    results[f"{backend}.match.hanzi_exact"] = measure(lambda: run(queries["hanzi"], True), repeat, len(queries["hanzi"]))
+    manager.close_all()
+    return results
+
+
+def batch_benchmarks(conn: sqlite3.Connection, rows: List[tuple], rng: random.Random, repeat: int) -> Dict[str, Any]:
+    """
+    Batch mode search of a pasted list: splitting the text and one batch lookup over all its words.
+    """
+    words = [rng.choice(rows)[0] for _ in range(BATCH_WORDS)]
+    text = "\n".join(words)
+
+    def run(exact: bool):
+        split = engine.split_string(text)
+        lookup.batch_lookup(conn, split, exact, [None] * len(split))
+
+    return {
+        "batch.exact": measure(lambda: run(True), repeat, BATCH_WORDS),
+        "batch.substring": measure(lambda: run(False), repeat, BATCH_WORDS),
+    }
+
+
+class FakeModels:
+    def field_map(self, notetype: Dict[str, Any]) -> Dict[str, tuple]:
+        return {name: (i, None) for i, name in enumerate(FIELDS)}
+
+
+class FakeDb:
+    def __init__(self, fields: List[str]):
+        self.fields = fields
+
+    def list(self, sql: str, *args) -> List[str]:
+        return self.fields
+
+
+class FakeCollection:
+    """
+    The parts of a collection DuplicateIndex reads: the field map and the fields of every note.
+    """
+
+    def __init__(self, fields: List[str]):
+        self.models = FakeModels()
+        self.db = FakeDb(fields)
+
+
+def duplicate_benchmarks(rows: List[tuple], rng: random.Random, repeat: int) -> Dict[str, Any]:
+    """
+    Duplicate checks of add_notes_op, against a collection holding a note for every second dictionary entry.
+    """
+    existing = rows[::2]
+    col = FakeCollection(["\x1f".join((simp, trad, notes.format_pinyin(pinyin, True), eng)) for trad, simp, pinyin, eng in existing])
+    candidates = [rng.choice(rows) for _ in range(DUPLICATE_CANDIDATES)]
+    keys = [[simp, trad, eng] for trad, simp, pinyin, eng in candidates]
+    notetype = {"id": 1}
+    field_names = [FIELDS[0], FIELDS[1], FIELDS[3]]
+
+    def check():
+        index = notes.DuplicateIndex(col, notetype, field_names)
+        for key in keys:
+            if not index.is_duplicate(key):
+                index.add(key)
+
+    return {"add_note.duplicate_check": measure(check, repeat, DUPLICATE_CANDIDATES) | {"notes": len(existing)}}
+
+
+def identify_benchmarks(rows: List[tuple], repeat: int) -> Dict[str, Any]:
+    strings = [hanzi for row in rows[: IDENTIFY_STRINGS // 2] for hanzi in row[:2]]
+    return {
+        "identify": measure(lambda: [hanzidentifier.identify(s) for s in strings], repeat, len(strings)),
+        "identify_many": measure(lambda: hanzidentifier.identify_many(strings), repeat, len(strings)),
+    }
+
+
+def segment_benchmarks(db_path: str, rows: List[tuple], rng: random.Random, repeat: int) -> Dict[str, Any]:
+    dictionary = engine.DictionaryEngine(db_path)
+    text = "".join(rng.choice(rows)[1] for _ in range(BATCH_WORDS))
+    results = {"segment.build": measure(lambda: dictionary.segment(""), 1, 1)}
+    results["segment.text"] = measure(lambda: dictionary.segment(text), repeat, BATCH_WORDS)
+    dictionary.close()
+    return results
+
+
+def run_size(size: int, workdir: str, repeat: int, seed: int) -> Dict[str, Any]:
+    source = join(workdir, f"cedict_{size}.txt")
+    if not exists(source):
+        synthetic.generate(source, size, seed)
+    directory = join(workdir, str(size))
+    results: Dict[str, Any] = {"build": build(source, directory)}
+    if "error" in results["build"]:
+        return results
+
+    db_path = join(directory, "CC-CEDICT_dictionary.db")
+    rng = random.Random(seed)
+    conn = engine.open_read_only(db_path)
+    rows = conn.execute("SELECT hanzi_trad, hanzi_simp, pinyin, eng FROM dictionary").fetchall()
+    queries = sample_queries(conn, rng)
+    for backend in ["sqlite", "binary"]:
+        results.update(search_benchmarks(db_path, backend, queries, repeat))
+    results.update(batch_benchmarks(conn, rows, rng, repeat))
+    results.update(duplicate_benchmarks(rows, rng, repeat))
+    results.update(identify_benchmarks(rows, repeat))
+    results.update(segment_benchmarks(db_path, rows, rng, repeat))
+    conn.close()
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 120000, 1000000], help="dictionary sizes in entries")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic dictionaries and queries")
+    parser.add_argument("--workdir", help="directory for the generated dictionaries, kept between runs (default: a temporary directory)")
+    parser.add_argument("--output", help="JSON file to write (default: standard output)")
+    args = parser.parse_args()
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        for size in args.sizes:
+            print(f"Benchmarking {size} entries", file=sys.stderr)
+            report["results"][str(size)] = run_size(size, workdir, args.repeat, args.seed)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,129 @@
+"""
+Stand-ins for aqt, anki and the generated forms, so that the add-on modules can be imported, tested and timed
+without Anki or Qt. Only the tests and the benchmarks use them, the add-on itself always runs inside Anki.
+"""
+
+import re
+import sys
+import types
+
+from typing import Any
+
+# Qt names the add-on imports with "from aqt.qt import *"
+QT_NAMES = [
+    "Qt",
+    "QAbstractTableModel",
+    "QAction",
+    "QCompleter",
+    "QDialog",
+    "QEvent",
+    "QFileDialog",
+    "QFont",
+    "QIcon",
+    "QKeySequence",
+    "QModelIndex",
+    "QObject",
+    "QPixmap",
+    "QProgressBar",
+    "QShortcut",
+    "QStringListModel",
+    "QTimer",
+    "QWidget",
+]
+
+
+class StubType(type):
+    def __getattr__(cls, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Stub
+
+
+class Stub(metaclass=StubType):
+    """
+    Accepts any constructor arguments, attribute access and call. Works as a base class, an enum namespace
+    (Qt.ItemDataRole.DisplayRole) and an object such as mw.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Stub()
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return Stub()
+
+    def __iter__(self):
+        return iter(())
+
+    def __class_getitem__(cls, item):
+        return cls
+
+
+def strip_html(text: str) -> str:
+    return re.sub(r"<[^>]*>", "", text)
+
+
+def stub_attribute(name: str) -> Any:
+    """
+    Module level __getattr__ of the stub modules: names that are not listed explicitly resolve to stubs as well.
+    """
+    if name.startswith("__"):
+        raise AttributeError(name)
+    return Stub
+
+
+def stub_module(name: str, **attributes) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    module.__getattr__ = stub_attribute
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """
+    Register the stub modules for aqt and anki. Modules that are really installed are left alone.
+    """
+    try:
+        import aqt  # noqa: F401
+        import anki  # noqa: F401
+
+        return
+    except ImportError:
+        pass
+    stub_module("aqt", mw=Stub(), gui_hooks=Stub())
+    qt = stub_module("aqt.qt", __all__=QT_NAMES)
+    qt.__dict__.update({name: type(name, (Stub,), {}) for name in QT_NAMES})
+    stub_module("aqt.browser")
+    stub_module("aqt.editor")
+    stub_module("aqt.reviewer")
+    stub_module("aqt.operations")
+    stub_module("aqt.utils", showInfo=lambda *args, **kwargs: None, tooltip=lambda *args, **kwargs: None)
+    stub_module("anki")
+    stub_module("anki.collection")
+    stub_module("anki.models", NotetypeDict=dict)
+    stub_module("anki.notes")
+    stub_module("anki.utils", strip_html=strip_html)
+
+
+def load_addon(root: str, name: str = "cedict_addon") -> str:
+    """
+    Make the add-on folder importable as a package without running its __init__.py, which registers the
+    add-on with Anki. The generated dialog form is stubbed, it only exists after tools/build_ui.sh ran.
+
+    :param root: the add-on folder
+    :param name: the package name to register
+    :return: the package name, e.g. for importlib.import_module(f"{name}.cedict.lookup")
+    """
+    install()
+    package = types.ModuleType(name)
+    package.__path__ = [root]
+    sys.modules[name] = package
+    forms = stub_module(f"{name}.forms")
+    forms.__path__ = []
+    stub_module(f"{name}.forms.dict_ui", Ui_Dialog=Stub)
+    return name
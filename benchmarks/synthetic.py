@@ -0,0 +1,78 @@
+"""
+Synthetic CC-CEDICT files of any size, in the format of the real release, for benchmarking.
+"""
+
+import random
+
+SYLLABLES = (
+    "a ai an ang ba bai ban bang bao bei ben bi bian biao bie bing bo bu ca cai can cang ce chang chao che chen "
+    "cheng chi chong chu chuan chun ci cong cu cun da dai dan dang dao de deng di dian diao ding dong dou du duan "
+    "dui duo e er fa fan fang fei fen feng fu gai gan gang gao ge gei gen geng gong gou gu gua guan guang gui guo "
+    "ha hai han hang hao he hei hen hong hou hu hua huai huan huang hui hun huo ji jia jian jiang jiao jie jin jing "
+    "jiu ju juan jue jun ka kai kan kang kao ke ken kong kou ku kuai kuan kuang kun la lai lan lang lao le lei li "
+    "lian liang liao lin ling liu long lou lu lu: luan lun luo ma mai man mang mao mei men meng mi mian miao min "
+    "ming mo mou mu na nan nao ne nei neng ni nian niao nin ning niu nong nu nu: nuan nuo pa pai pan pang pao pei "
+    "pen peng pi pian piao pin ping po pu qi qia qian qiang qiao qie qin qing qiong qiu qu quan que qun ran rang "
+    "rao re ren reng ri rong rou ru ruan rui run ruo sa san sang se sen sha shan shang shao she shen sheng shi shou "
+    "shu shua shuai shuang shui shun shuo si song su suan sui sun suo ta tai tan tang tao te teng ti tian tiao tie "
+    "ting tong tou tu tuan tui tun tuo wa wai wan wang wei wen wo wu xi xia xian xiang xiao xie xin xing xiong xiu "
+    "xu xuan xue xun ya yan yang yao ye yi yin ying yong you yu yuan yue yun za zai zan zang zao ze zen zeng zha "
+    "zhai zhan zhang zhao zhe zhen zheng zhi zhong zhou zhu zhua zhuan zhuang zhui zhun zhuo zi zong zou zu zuan "
+    "zui zun zuo"
+).split()
+
+WORDS = (
+    "to be have do say go get make know think take see come want look use find give tell work call try ask need "
+    "feel become leave put mean keep let begin seem help talk turn start show hear play run move like live believe "
+    "hold bring happen write provide sit stand lose pay meet include continue set learn change lead understand "
+    "watch follow stop create speak read allow add spend grow open walk win offer remember love consider appear buy "
+    "wait serve die send expect build stay fall cut reach kill remain person year way day thing man world life hand "
+    "part child eye woman place week case point government company number group problem fact good new first last "
+    "long great little own other old right big high different small large next early young important few public "
+    "bad same able red green water tree river mountain country city family friend student teacher school book"
+).split()
+
+# CJK unified ideographs used for headwords
+HANZI_FIRST = 0x4E00
+HANZI_COUNT = 20000
+
+
+def random_hanzi(rng: random.Random, length: int) -> str:
+    return "".join(chr(HANZI_FIRST + rng.randrange(HANZI_COUNT)) for _ in range(length))
+
+
+def random_sense(rng: random.Random) -> str:
+    sense = " ".join(rng.choice(WORDS) for _ in range(rng.choice((1, 1, 2, 3))))
+    if rng.random() < 0.1:
+        sense += f" (CL:{random_hanzi(rng, 1)}[{rng.choice(SYLLABLES)}{rng.randint(1, 5)}])"
+    return sense
+
+
+def entry_line(rng: random.Random) -> str:
+    length = rng.choice((1, 2, 2, 2, 2, 3, 3, 4))
+    simplified = random_hanzi(rng, length)
+    # Most headwords are the same in both scripts, the others differ in one character
+    traditional = simplified
+    if rng.random() < 0.3:
+        i = rng.randrange(length)
+        traditional = simplified[:i] + random_hanzi(rng, 1) + simplified[i + 1 :]
+    pinyin = " ".join(f"{rng.choice(SYLLABLES)}{rng.randint(1, 5)}" for _ in range(length))
+    senses = "/".join(random_sense(rng) for _ in range(rng.randint(1, 5)))
+    return f"{traditional} {simplified} [{pinyin}] /{senses}/\n"
+
+
+def generate(path: str, entries: int, seed: int = 0):
+    """
+    Write a CC-CEDICT file with random entries. The same seed always gives the same file.
+
+    :param path: the file to write
+    :param entries: the number of entries
+    :param seed: the seed of the random generator
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf8") as f:
+        f.write("# CC-CEDICT\n# Synthetic benchmark dictionary\n")
+        f.write(f"#! version=1\n#! subversion=0\n#! format=ts\n#! charset=UTF-8\n#! entries={entries}\n")
+        f.write("#! date=2000-01-01T00:00:00Z\n")
+        for _ in range(entries):
+            f.write(entry_line(rng))
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+
+from itertools import islice
+from os.path import dirname, exists, join, realpath
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from .engine import DictionaryEngine
+from .lookup import Row
+
+# Lines of the corpus a worker annotates at a time
+CHUNK_LINES = 500
+
+# Chunks handed to the pool at once per worker, so that large corpora are never read into memory whole
+CHUNKS_PER_WORKER = 4
+
+TSV_COLUMNS = ["line", "word", "traditional", "simplified", "pinyin", "senses"]
+
+# A word of the corpus: its line number, the word and its dictionary entries
+Annotation = Tuple[int, str, List[Row]]
+
+# The engine of a worker process, opened by init_worker
+engine: Optional[DictionaryEngine] = None
+
+
+def init_worker(db_path: str):
+    global engine
+    engine = DictionaryEngine(db_path)
+
+
+def annotate_lines(chunk: Tuple[int, List[str]]) -> List[Annotation]:
+    """
+    Segment lines into dictionary words and look up all words of the lines at once.
+
+    :param chunk: the line number of the first line and the lines
+    :return: the words of the lines in order, with their entries
+    """
+    first, lines = chunk
+    words = [engine.segment(line) for line in lines]
+    entries = engine.headwords([word for line_words in words for word in line_words])
+    return [(first + i, word, entries.get(word, [])) for i, line_words in enumerate(words) for word in line_words]
+
+
+def read_chunks(lines: Iterable[str], size: int) -> Iterator[Tuple[int, List[str]]]:
+    lines = iter(lines)
+    first = 1
+    while chunk := list(islice(lines, size)):
+        yield first, chunk
+        first += len(chunk)
+
+
+def annotate(lines: Iterable[str], db_path: str, workers: int) -> Iterator[Annotation]:
+    """
+    Stream a corpus through the dictionary engine, with one engine and read-only connection per worker process.
+
+    :param lines: the lines of the corpus
+    :param db_path: the dictionary database
+    :param workers: the number of worker processes, 1 to annotate in this process
+    :return: the words of the corpus in order, with their entries
+    """
+    chunks = read_chunks(lines, CHUNK_LINES)
+    if workers <= 1:
+        init_worker(db_path)
+        for chunk in chunks:
+            yield from annotate_lines(chunk)
+        return
+    with multiprocessing.Pool(workers, init_worker, (db_path,)) as pool:
+        while window := list(islice(chunks, workers * CHUNKS_PER_WORKER)):
+            for annotations in pool.imap(annotate_lines, window):
+                yield from annotations
+
+
+def write_tsv(out: IO[str], annotations: Iterable[Annotation]):
+    """
+    One row per entry of each word, the senses separated by slashes as in CC-CEDICT. Words without an entry
+    get a row with empty entry columns.
+    """
+    out.write("\t".join(TSV_COLUMNS) + "\n")
+    for line, word, rows in annotations:
+        for trad, simp, pinyin, _, senses in rows or [("", "", "", "", ())]:
+            out.write(f"{line}\t{word}\t{trad}\t{simp}\t{pinyin}\t{'/'.join(senses)}\n")
+
+
+def write_jsonl(out: IO[str], annotations: Iterable[Annotation]):
+    """
+    One JSON object per word, with the list of its entries.
+    """
+    for line, word, rows in annotations:
+        entries = [{"traditional": trad, "simplified": simp, "pinyin": pinyin, "senses": list(senses)} for trad, simp, pinyin, _, senses in rows]
+        out.write(json.dumps({"line": line, "word": word, "entries": entries}, ensure_ascii=False) + "\n")
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Annotate a Chinese text corpus with CC-CEDICT entries.")
+    parser.add_argument("corpus", help="a UTF-8 text file, - for standard input")
+    parser.add_argument("--db", default=join(dirname(realpath(__file__)), "../CC-CEDICT_dictionary.db"), help="the dictionary database")
+    parser.add_argument("--format", choices=["tsv", "jsonl"], default="tsv")
+    parser.add_argument("--output", help="the file to write (default: standard output)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+    if not exists(args.db):
+        parser.error(f"no dictionary at {args.db}, build it with tools/database.py")
+
+    write = write_tsv if args.format == "tsv" else write_jsonl
+    corpus = sys.stdin if args.corpus == "-" else open(args.corpus, encoding="utf-8-sig")
+    out = sys.stdout if args.output is None else open(args.output, "w", encoding="utf8", newline="\n")
+    try:
+        write(out, annotate(corpus, args.db, args.workers))
+    finally:
+        if corpus is not sys.stdin:
+            corpus.close()
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,326 @@
+import sys
+import mmap
+import struct
+import sqlite3
+
+from array import array
+from os.path import splitext
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .lookup import Row
+
+MAGIC = b"CEDICTB1"
+VERSION = 3
+
+# Sections in file order. Strings are stored once in a UTF-8 pool and referenced by their number in the
+# offset table. Each index is a pair of uint32 arrays: keys (string numbers, sorted by their UTF-8 bytes,
+# which is the order SQLite compares text in) and the values for each key (entry numbers in rank order, like
+# the ranked SQLite indexes, or sense numbers in order).
+SECTIONS = [
+    "offsets",  # start of each string in the pool, plus the end of the last string
+    "pool",  # UTF-8 bytes of all strings
+    "entries",  # traditional, simplified, pinyin and english string of each entry
+    "sense_starts",  # first sense of each entry, plus the end of the last entry's senses
+    "order",  # position of each entry in rank order, with ties in entry order
+    "senses",  # string of each sense, entries' senses are consecutive and in order
+    "trad_keys",  # traditional headwords to entries
+    "trad_values",
+    "simp_keys",  # simplified headwords to entries
+    "simp_values",
+    "gram_keys",  # character unigrams and bigrams of the headwords to entries
+    "gram_values",
+    "pinyin_keys",  # numbered and toneless pinyin keys to entries
+    "pinyin_values",
+    "sense_keys",  # normalized senses to entries
+    "sense_values",
+    "token_keys",  # sense tokens to senses
+    "token_values",
+    "sample",  # entries for the random samples
+]
+
+HEADER = struct.Struct(f"<8sII{len(SECTIONS) * 2}Q")
+
+# Sections start at multiples of 8 bytes, so that the uint32 arrays can be used in place
+ALIGNMENT = 8
+
+
+class StringTable:
+    def __init__(self):
+        self.numbers: Dict[str, int] = {}
+        self.pool = bytearray()
+        self.offsets = array("I", [0])
+
+    def add(self, s: str) -> int:
+        number = self.numbers.get(s)
+        if number is None:
+            number = self.numbers[s] = len(self.numbers)
+            self.pool += s.encode("utf8")
+            self.offsets.append(len(self.pool))
+        return number
+
+
+def binary_path(db_path: str) -> str:
+    """
+    The binary dictionary written next to a dictionary database.
+    """
+    return splitext(db_path)[0] + ".bin"
+
+
+def key_index(strings: StringTable, pairs: Iterable[Tuple[str, int]], order: Optional[Sequence[int]] = None) -> Tuple[array, array]:
+    """
+    Sort key and value pairs by the UTF-8 bytes of the key, then by the position of the value in the order if
+    one is given, or else by value.
+
+    :return: the key string numbers and the values, in that order
+    """
+    encoded = sorted({(key.encode("utf8"), value if order is None else order[value], value, key) for key, value in pairs})
+    return array("I", (strings.add(key) for *_, key in encoded)), array("I", (value for _, _, value, _ in encoded))
+
+
+def is_current(path: str) -> bool:
+    """
+    Whether a binary dictionary exists and is of the version BinaryDictionary reads.
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, version, *_ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and version == VERSION
+
+
+def little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_binary(conn: sqlite3.Connection, path: str):
+    """
+    Write the dictionary of a database built by tools/database.py as a binary file for BinaryDictionary.
+    Entries are numbered in rowid order, gaps left by deleted rows are closed.
+
+    :param conn: the built dictionary database
+    :param path: the file to write
+    """
+    strings = StringTable()
+    numbers: Dict[int, int] = {}
+    entries = array("I")
+    for rowid, *columns in conn.execute("SELECT rowid, hanzi_trad, hanzi_simp, pinyin, eng FROM dictionary ORDER BY rowid"):
+        numbers[rowid] = len(numbers)
+        entries.extend(strings.add(column) for column in columns)
+
+    sense_numbers: Dict[Tuple[int, int], int] = {}
+    sense_starts = array("I", [0] * (len(numbers) + 1))
+    senses = array("I")
+    sense_pairs = []
+    for rowid, ordinal, text, tokens in conn.execute("SELECT id, ordinal, text, tokens FROM senses ORDER BY id, ordinal"):
+        sense_numbers[rowid, ordinal] = len(senses)
+        sense_starts[numbers[rowid] + 1] += 1
+        senses.append(strings.add(text))
+        sense_pairs.append((tokens, numbers[rowid]))
+    for i in range(len(numbers)):
+        sense_starts[i + 1] += sense_starts[i]
+
+    order = array("I", [0] * len(numbers))
+    for position, (rowid,) in enumerate(conn.execute("SELECT rowid FROM dictionary ORDER BY rank, rowid")):
+        order[numbers[rowid]] = position
+
+    headwords = conn.execute("SELECT rowid, hanzi_trad, hanzi_simp FROM dictionary").fetchall()
+    indexes = [
+        key_index(strings, ((trad, numbers[rowid]) for rowid, trad, simp in headwords), order),
+        key_index(strings, ((simp, numbers[rowid]) for rowid, trad, simp in headwords), order),
+        key_index(strings, ((gram, numbers[rowid]) for gram, rowid in conn.execute("SELECT gram, id FROM hanzi_grams")), order),
+        key_index(strings, ((key, numbers[rowid]) for key, rowid in conn.execute("SELECT key, id FROM pinyin_keys")), order),
+        key_index(strings, sense_pairs, order),
+        key_index(
+            strings, ((token, sense_numbers[rowid, ordinal]) for token, rowid, ordinal in conn.execute("SELECT token, id, ordinal FROM sense_tokens"))
+        ),
+    ]
+    sample = array("I", (numbers[rowid] for (rowid,) in conn.execute("SELECT id FROM sample_pool ORDER BY pos")))
+
+    sections = [
+        little_endian(strings.offsets),
+        bytes(strings.pool),
+        little_endian(entries),
+        little_endian(sense_starts),
+        little_endian(order),
+        little_endian(senses),
+    ]
+    for keys, values in indexes:
+        sections += [little_endian(keys), little_endian(values)]
+    sections.append(little_endian(sample))
+
+    positions = []
+    position = HEADER.size
+    for data in sections:
+        position += -position % ALIGNMENT
+        positions += [position, len(data)]
+        position += len(data)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(SECTIONS), *positions))
+        for data in sections:
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+            f.write(data)
+
+
+def precedes(string: memoryview, key: bytes) -> bool:
+    """
+    Compare a string of the pool with a key by their bytes, in place: memoryviews only compare for equality.
+    """
+    for a, b in zip(string, key):
+        if a != b:
+            return a < b
+    return len(string) < len(key)
+
+
+class KeyIndex:
+    """
+    Sorted keys with their values, searched by bisection without decoding or copying the keys.
+    """
+
+    def __init__(self, dictionary: "BinaryDictionary", keys: Sequence[int], values: Sequence[int]):
+        self.dictionary = dictionary
+        self.keys = keys
+        self.values = values
+
+    def lower_bound(self, key: bytes, low: int = 0, high: Optional[int] = None) -> int:
+        """
+        Return the position of the first key that is not smaller than the given key, between low and high.
+        """
+        high = len(self.keys) if high is None else high
+        while low < high:
+            middle = (low + high) // 2
+            if precedes(self.dictionary.raw(self.keys[middle]), key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, key: str) -> Sequence[int]:
+        encoded = key.encode("utf8")
+        start = low = high = self.lower_bound(encoded)
+        # Most keys have one or a few values, but a common character has tens of thousands. Their end is searched
+        # for in growing steps, comparing for equality is cheap, and then by bisection up to the first key after
+        step = 1
+        while high < len(self.keys) and self.dictionary.raw(self.keys[high]) == encoded:
+            low = high + 1
+            high += step
+            step *= 2
+        return self.values[start : self.lower_bound(encoded + b"\0", low, min(high, len(self.keys)))]
+
+
+class BinaryDictionary:
+    """
+    Read-only dictionary in the binary format written by write_binary, memory-mapped instead of read.
+
+    Opening only maps the file and reads the header, the operating system pages in what the lookups touch and
+    can drop it again under memory pressure. The arrays and the string pool are used in place through
+    memoryviews. Strings are only decoded for the rows that are returned.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.views: List[memoryview] = []
+        try:
+            magic, version, count, *positions = HEADER.unpack_from(self.mmap)
+            if magic != MAGIC or version != VERSION or count != len(SECTIONS):
+                raise ValueError(f"{path} is not a CC-CEDICT binary dictionary of version {VERSION}")
+            sections = {}
+            for name, start, length in zip(SECTIONS, positions[::2], positions[1::2]):
+                view = memoryview(self.mmap)[start : start + length]
+                self.views.append(view)
+                sections[name] = view if name == "pool" else self.uint32(view)
+        except Exception:
+            self.close()
+            raise
+        self.offsets = sections["offsets"]
+        self.pool = sections["pool"]
+        self.entries = sections["entries"]
+        self.sense_starts = sections["sense_starts"]
+        self.order = sections["order"]
+        self.senses = sections["senses"]
+        self.trad = KeyIndex(self, sections["trad_keys"], sections["trad_values"])
+        self.simp = KeyIndex(self, sections["simp_keys"], sections["simp_values"])
+        self.grams = KeyIndex(self, sections["gram_keys"], sections["gram_values"])
+        self.pinyin = KeyIndex(self, sections["pinyin_keys"], sections["pinyin_values"])
+        self.sense_index = KeyIndex(self, sections["sense_keys"], sections["sense_values"])
+        self.tokens = KeyIndex(self, sections["token_keys"], sections["token_values"])
+        self.sample = sections["sample"]
+
+    def uint32(self, view: memoryview) -> Sequence[int]:
+        if sys.byteorder == "little":
+            values = view.cast("I")
+            self.views.append(values)
+            return values
+        # Big-endian machines get a byte-swapped copy
+        values = array("I", view.tobytes())
+        values.byteswap()
+        return values
+
+    def close(self):
+        # The mapping can only be closed once no memoryview refers to it
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.mmap.close()
+
+    def __len__(self) -> int:
+        return len(self.entries) // 4
+
+    def raw(self, number: int) -> memoryview:
+        return self.pool[self.offsets[number] : self.offsets[number + 1]]
+
+    def string(self, number: int) -> str:
+        return str(self.pool[self.offsets[number] : self.offsets[number + 1]], "utf8")
+
+    def headword(self, entry: int) -> Tuple[str, str]:
+        return self.string(self.entries[entry * 4]), self.string(self.entries[entry * 4 + 1])
+
+    def row(self, entry: int) -> Row:
+        trad, simp, pinyin, eng = (self.string(number) for number in self.entries[entry * 4 : entry * 4 + 4])
+        senses = tuple(self.string(number) for number in self.senses[self.sense_starts[entry] : self.sense_starts[entry + 1]])
+        return trad, simp, pinyin, eng, senses
+
+    def rows(self, entries: Iterable[int]) -> List[Row]:
+        return [self.row(entry) for entry in entries]
+
+    def ranked(self, entries: Sequence[int], after: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+        """
+        Yield the rank position and number of the entries of an index value list, which are in rank order.
+
+        :param entries: values returned by KeyIndex.get
+        :param after: only yield the entries ranked after this position
+        """
+        start = 0
+        if after is not None:
+            end = len(entries)
+            while start < end:
+                middle = (start + end) // 2
+                if self.order[entries[middle]] <= after:
+                    start = middle + 1
+                else:
+                    end = middle
+        for i in range(start, len(entries)):
+            yield self.order[entries[i]], entries[i]
+
+    def headwords(self) -> Iterator[str]:
+        for entry in range(len(self)):
+            yield from self.headword(entry)
+
+    def find_sense(self, tokens: Iterable[str]) -> Optional[int]:
+        """
+        Find a sense containing all tokens, by intersecting the senses of each token, rarest token first.
+        """
+        postings = sorted((self.tokens.get(token) for token in tokens), key=len)
+        if not postings:
+            return None
+        senses = set(postings[0])
+        for posting in postings[1:]:
+            senses.intersection_update(posting)
+            if not senses:
+                return None
+        return min(senses, default=None)
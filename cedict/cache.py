@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from .binary import binary_path
+
+
+class QueryCache:
+    """
+    Least recently used cache for search results, bounded by entry count and by the approximate size of the
+    cached values. Everything is dropped when the dictionary database or the binary dictionary next to it
+    changes on disk.
+    """
+
+    def __init__(self, db_path: str, max_entries: int, max_bytes: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.signature = self.file_signature()
+        self.lock = threading.Lock()
+
+    def file_signature(self) -> Tuple[Optional[Tuple[int, int]], ...]:
+        return tuple(path_signature(path) for path in (self.db_path, binary_path(self.db_path)))
+
+    def validate(self):
+        """
+        Clear the cache if a dictionary file was created, replaced, modified or removed since the cache was filled.
+        """
+        signature = self.file_signature()
+        if signature != self.signature:
+            self.clear()
+            self.signature = signature
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.size}
+
+
+def path_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Approximate the memory used by nested lists and tuples of strings.
+    """
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
@@ -1,8 +1,55 @@
+from typing import List, Optional
+
+from anki.collection import Collection, OpChanges
 from aqt import mw
-from aqt.qt import QCompleter
+from aqt.qt import QCompleter, QModelIndex, QStringListModel, Qt
 from aqt.utils import showInfo
 
 
+class TagIndex:
+    """
+    Tags from the collection's tag registry, sorted case-insensitively so the completer can binary search them.
+    Kept between dialog openings and only reloaded after the tags of the collection changed.
+    """
+
+    def __init__(self):
+        self.model = QStringListModel()
+        self.col: Optional[Collection] = None
+        self.stale = True
+
+    def invalidate(self):
+        self.stale = True
+
+    def load(self):
+        if self.stale or self.col is not mw.col:
+            tags = [tag for tag in mw.col.tags.all() if "leech" not in tag]
+            tags.sort(key=str.lower)
+            self.model.setStringList(tags)
+            self.col = mw.col
+            self.stale = False
+
+
+class TagCompleter(QCompleter):
+    """
+    Completes the last of the space separated tags in a line edit.
+    """
+
+    def splitPath(self, path: str) -> List[str]:
+        return [path.split(" ")[-1]]
+
+    def pathFromIndex(self, index: QModelIndex) -> str:
+        text = self.widget().text()
+        return text[: text.rfind(" ") + 1] + index.data()
+
+
+tag_index = TagIndex()
+
+
+def tags_changed(changes: OpChanges, handler: Optional[object]):
+    if changes.tag:
+        tag_index.invalidate()
+
+
 def find_fields(self):
     # Remove old items
     self.dialog.Field1.blockSignals(True)
@@ -16,12 +63,8 @@ def find_fields(self):
     self.dialog.Field4.clear()
 
     # Find fields of the selected notetype and add them to dropdown
-    out = mw.col.models.all()
-    fieldlist = []
-    for l in out:
-        if l["name"] == self.dialog.Notetype.currentText():
-            for i in l["flds"]:
-                fieldlist.append(i["name"])
+    notetype = mw.col.models.by_name(self.dialog.Notetype.currentText())
+    fieldlist = mw.col.models.field_names(notetype) if notetype else []
     for i in fieldlist:
         self.dialog.Field1.addItem(str(i))
         self.dialog.Field2.addItem(str(i))
@@ -35,50 +78,29 @@ def find_fields(self):
 
     # Save notetype
     config = mw.addonManager.getConfig(__name__)
-    notetype_config = self.dialog.Notetype.currentText()
-    config = {
-        "deck_config": config["deck_config"],
-        "notetype_config": notetype_config,
-        "field_1_config": config["field_1_config"],
-        "field_2_config": config["field_2_config"],
-        "field_3_config": config["field_3_config"],
-        "field_4_config": config["field_4_config"],
-        "color_pinyin": config["color_pinyin"],
-        "tags": config["tags"],
-    }
+    config["notetype_config"] = self.dialog.Notetype.currentText()
     mw.addonManager.writeConfig(__name__, config)
 
 
 def find_tags(self):
-    all_tags = mw.col.db.all("select tags from notes")
-    tags = []
-    for i in all_tags:
-        tag = i[0].strip()
-        if tag not in tags and tag and "leech" not in tag:
-            tags.append(tag)
-    completer = QCompleter(tags)
-    self.dialog.tags.setCompleter(completer)
+    tag_index.load()
+    if not self.dialog.tags.completer():
+        completer = TagCompleter(tag_index.model, self.dialog.tags)
+        completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        completer.setModelSorting(QCompleter.ModelSorting.CaseInsensitivelySortedModel)
+        self.dialog.tags.setCompleter(completer)
 
 
 def save_config(self):
-    deck_config = self.dialog.Deck.currentText()
-    notetype_config = self.dialog.Notetype.currentText()
-    field_1_config = self.dialog.Field1.currentText()
-    field_2_config = self.dialog.Field2.currentText()
-    field_3_config = self.dialog.Field3.currentText()
-    field_4_config = self.dialog.Field4.currentText()
-    color_pinyin_config = self.dialog.color_pinyin.isChecked()
-    tags_config = self.dialog.tags.text()
-    config = {
-        "deck_config": deck_config,
-        "notetype_config": notetype_config,
-        "field_1_config": field_1_config,
-        "field_2_config": field_2_config,
-        "field_3_config": field_3_config,
-        "field_4_config": field_4_config,
-        "color_pinyin": color_pinyin_config,
-        "tags": tags_config,
-    }
+    config = mw.addonManager.getConfig(__name__)
+    config["deck_config"] = self.dialog.Deck.currentText()
+    config["notetype_config"] = self.dialog.Notetype.currentText()
+    config["field_1_config"] = self.dialog.Field1.currentText()
+    config["field_2_config"] = self.dialog.Field2.currentText()
+    config["field_3_config"] = self.dialog.Field3.currentText()
+    config["field_4_config"] = self.dialog.Field4.currentText()
+    config["color_pinyin"] = self.dialog.color_pinyin.isChecked()
+    config["tags"] = self.dialog.tags.text()
     mw.addonManager.writeConfig(__name__, config)
 
 
@@ -0,0 +1,122 @@
+import threading
+
+from os.path import exists
+from typing import Dict, Optional, Tuple
+
+from .dump import materialize
+from .engine import DictionaryEngine, open_engine
+from .timing import timed
+
+
+class ConnectionManager:
+    """
+    Hands out one dictionary engine per thread, opened on first use with the tuned read-only connection of
+    open_read_only and kept with its prepared statements until released.
+
+    A connection is only ever used by the thread it was handed to. Each thread releases its engine when it is
+    done, e.g. the search worker when it stops. On profile unload close_all closes whatever is still open,
+    after which engines are opened again on demand.
+
+    With a dump, the dictionary is first materialized from it on a background thread, see prepare. Nothing is
+    opened before that has finished, engine waits for it.
+    """
+
+    def __init__(self, db_path: str, backend: str = "sqlite", dump_path: Optional[str] = None):
+        self.db_path = db_path
+        self.backend = backend
+        self.dump_path = dump_path
+        self.engines: Dict[int, DictionaryEngine] = {}
+        self.lock = threading.Lock()
+        # Set once the dictionary can be opened, right away without a dump
+        self.ready = threading.Event()
+        self.builder: Optional[threading.Thread] = None
+        self.build_error: Optional[Exception] = None
+        # Phase, done and total of the running build, for progress indicators
+        self.progress: Tuple[str, int, int] = ("", 0, 0)
+        if dump_path is None or not exists(dump_path):
+            self.ready.set()
+
+    def configure(self, backend: str):
+        """
+        Switch to another backend, engines that are already open keep theirs until released.
+        """
+        self.backend = backend
+
+    def prepare(self):
+        """
+        Start materializing the dictionary from the dump on a background thread, if that was not started yet.
+        When the dictionary was already built from the same dump, the thread only checks that and finishes. The
+        binary dictionary is only built for the binary backend, configure the backend first.
+        """
+        with self.lock:
+            if self.ready.is_set() or self.builder is not None:
+                return
+            self.builder = threading.Thread(target=self.build, name="cedict-build", daemon=True)
+        self.builder.start()
+
+    def build(self):
+        try:
+            with timed("materialize"):
+                materialize(self.dump_path, self.db_path, self.backend == "binary", self.report_progress)
+        except Exception as e:
+            self.build_error = e
+        finally:
+            self.ready.set()
+
+    def report_progress(self, phase: str, done: int, total: int):
+        self.progress = (phase, done, total)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the dictionary can be opened, starting to materialize it if needed.
+
+        :return: whether it can, False if the timeout ran out first
+        """
+        self.prepare()
+        return self.ready.wait(timeout)
+
+    def available(self) -> bool:
+        """
+        Whether engine returns right away, without waiting for the dictionary to be built.
+        """
+        return self.ready.is_set() and self.build_error is None
+
+    def engine(self) -> DictionaryEngine:
+        """
+        Return the engine of the calling thread, opening it on first use. Waits while the dictionary is
+        materialized, and raises if that failed.
+        """
+        self.wait()
+        if self.build_error is not None:
+            raise RuntimeError(f"The dictionary could not be built: {self.build_error}") from self.build_error
+        thread = threading.get_ident()
+        with self.lock:
+            engine = self.engines.get(thread)
+        if engine is None:
+            with timed("connect"):
+                engine = open_engine(self.db_path, self.backend)
+            with self.lock:
+                self.engines[thread] = engine
+        return engine
+
+    def release(self):
+        """
+        Close the engine of the calling thread, if it has one.
+        """
+        with self.lock:
+            engine = self.engines.pop(threading.get_ident(), None)
+        if engine is not None:
+            engine.close()
+
+    def close_all(self):
+        """
+        Close the engines of all threads. Threads that are still searching must be stopped first.
+        """
+        with self.lock:
+            engines, self.engines = self.engines, {}
+        for engine in engines.values():
+            engine.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.engines)
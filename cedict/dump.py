@@ -0,0 +1,221 @@
+import os
+import json
+import lzma
+import sqlite3
+import hashlib
+
+from itertools import groupby
+from os.path import exists
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.request import pathname2url
+
+from .binary import BinaryDictionary, binary_path, is_current, write_binary
+from .schema import INDEXES, Entry, create_table, insert_entries, tune_for_bulk_load, write_metadata
+
+# A dump is an xz-compressed UTF-8 text stream: a JSON header line, then the frequency list as "word\tposition"
+# lines in list order, then the entries in row id order as "traditional\tsimplified\tpinyin\tsense\t..." lines.
+# The header holds the format version, the number of frequency words and entries, the release metadata and the
+# SHA-256 of everything after the header line.
+DUMP_VERSION = 1
+
+# Metadata key of the dump a database was materialized from
+DUMP_KEY = "dump_sha256"
+
+# Entries inserted at a time while materializing, with a progress update after each chunk
+MATERIALIZE_CHUNK = 5000
+
+# Phase, done and total, e.g. ("Loading entries", 5000, 120000)
+Progress = Callable[[str, int, int], None]
+
+
+def dump_lines(conn: sqlite3.Connection) -> Iterator[str]:
+    """
+    The lines of a dump after the header. A database materialized from a dump gives the same lines again, row ids
+    are not part of the dump.
+    """
+    for word, pos in conn.execute("SELECT word, pos FROM frequency ORDER BY pos, word"):
+        yield f"{word}\t{pos}\n"
+    rows = conn.execute(
+        "SELECT d.rowid, d.hanzi_trad, d.hanzi_simp, d.pinyin, s.text FROM dictionary d "
+        "LEFT JOIN senses s ON s.id = d.rowid ORDER BY d.rowid, s.ordinal"
+    )
+    for (rowid, *headword), senses in groupby(rows, key=lambda row: row[:4]):
+        fields = [*headword, *(text for *_, text in senses if text is not None)]
+        line = "\t".join(fields)
+        if "\n" in line or line.count("\t") != len(fields) - 1:
+            raise ValueError(f"Entry {rowid} contains a tab or line break and cannot be dumped")
+        yield line + "\n"
+
+
+def write_dump(conn: sqlite3.Connection, path: str):
+    """
+    Write the dictionary of a database built by tools/database.py as a compressed dump, the form the add-on is
+    distributed in. The add-on materializes the database from it on first use, see materialize.
+
+    :param conn: the built dictionary database
+    :param path: the file to write
+    """
+    digest = hashlib.sha256()
+    for line in dump_lines(conn):
+        digest.update(line.encode("utf8"))
+    header = {
+        "version": DUMP_VERSION,
+        "frequency": conn.execute("SELECT COUNT(*) FROM frequency").fetchone()[0],
+        "entries": conn.execute("SELECT COUNT(*) FROM dictionary").fetchone()[0],
+        "metadata": dict(conn.execute("SELECT key, value FROM metadata WHERE key != ?", (DUMP_KEY,))),
+        "sha256": digest.hexdigest(),
+    }
+    with lzma.open(path, "wt", encoding="utf8", newline="\n", preset=9) as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        f.writelines(dump_lines(conn))
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    # Only the first block of the stream is decompressed
+    with lzma.open(path, "rt", encoding="utf8", newline="\n") as f:
+        header = json.loads(f.readline())
+    if header.get("version") != DUMP_VERSION:
+        raise ValueError(f"{path} is not a CC-CEDICT dump of version {DUMP_VERSION}")
+    return header
+
+
+def materialized_from(db_path: str) -> Optional[str]:
+    """
+    The checksum of the dump a database was materialized from, None if it does not exist or was built by
+    tools/database.py.
+    """
+    if not exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{pathname2url(db_path)}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM metadata WHERE key = ?", (DUMP_KEY,)).fetchone()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def load_dump(f, header: Dict[str, Any], c: sqlite3.Cursor, on_progress: Progress) -> str:
+    """
+    Load the frequency list and the entries of an open dump, positioned after the header.
+
+    :return: the SHA-256 of what was read
+    """
+    digest = hashlib.sha256()
+    frequency: Dict[str, int] = {}
+    for _ in range(header["frequency"]):
+        line = f.readline()
+        digest.update(line.encode("utf8"))
+        word, pos = line.rstrip("\n").split("\t")
+        frequency[word] = int(pos)
+    c.executemany("INSERT INTO frequency (word, pos) VALUES(?, ?)", frequency.items())
+
+    rowid = 0
+    entries: List[Entry] = []
+    for line in f:
+        digest.update(line.encode("utf8"))
+        hanzi_trad, hanzi_simp, p, *senses = line.rstrip("\n").split("\t")
+        entries.append((hanzi_trad, hanzi_simp, p, tuple(senses)))
+        if len(entries) == MATERIALIZE_CHUNK:
+            rowid = insert_entries(c, entries, rowid, frequency)
+            entries = []
+            on_progress("Loading entries", rowid, header["entries"])
+    rowid = insert_entries(c, entries, rowid, frequency)
+    if rowid != header["entries"]:
+        raise ValueError(f"Expected {header['entries']} entries, the dump has {rowid}")
+    return digest.hexdigest()
+
+
+def materialize(dump_path: str, db_path: str, binary: bool, on_progress: Progress) -> bool:
+    """
+    Build the dictionary database from a dump, unless it was already built from the same dump, and the binary
+    dictionary if it is wanted and missing. Each file is built next to its final path and only moved there once
+    verified: the dump against its checksum, the database by dumping it again and the binary dictionary by its
+    entry count. An interrupted or failed build leaves the previous files alone.
+
+    :param dump_path: the dump shipped with the add-on
+    :param db_path: the database to build, the binary dictionary is written next to it
+    :param binary: whether to build the binary dictionary as well, for the binary backend
+    :param on_progress: called from the building thread with the phase, done and total
+    :return: whether anything was built
+    """
+    header = read_header(dump_path)
+    built = False
+    if materialized_from(db_path) != header["sha256"]:
+        temp = db_path + ".tmp"
+        build_file(temp, lambda: build_database(dump_path, header, temp, on_progress))
+        # A binary dictionary of the previous database would be stale, it is removed first
+        if exists(binary_path(db_path)):
+            os.remove(binary_path(db_path))
+        os.replace(temp, db_path)
+        built = True
+    # A binary dictionary written by an older version of the add-on is rewritten in the current format
+    if binary and not is_current(binary_path(db_path)):
+        on_progress("Writing the binary dictionary", 0, 1)
+        temp = binary_path(db_path) + ".tmp"
+        build_file(temp, lambda: build_binary(db_path, header, temp))
+        os.replace(temp, binary_path(db_path))
+        built = True
+    return built
+
+
+def build_file(temp: str, build: Callable[[], None]):
+    # Leftovers of an interrupted build are removed before, a failed build's output after
+    if exists(temp):
+        os.remove(temp)
+    try:
+        build()
+    except BaseException:
+        if exists(temp):
+            os.remove(temp)
+        raise
+
+
+def build_database(dump_path: str, header: Dict[str, Any], path: str, on_progress: Progress):
+    conn = sqlite3.connect(path)
+    try:
+        c = conn.cursor()
+        tune_for_bulk_load(c)
+        create_table(c)
+        try:
+            with lzma.open(dump_path, "rt", encoding="utf8", newline="\n") as f:
+                f.readline()
+                digest = load_dump(f, header, c, on_progress)
+        except (ValueError, lzma.LZMAError, EOFError) as e:
+            raise ValueError(f"{dump_path} is damaged, reinstall the add-on ({e})") from e
+        if digest != header["sha256"]:
+            raise ValueError(f"{dump_path} is damaged, reinstall the add-on")
+        for i, create_index in enumerate(INDEXES):
+            on_progress("Indexing", i, len(INDEXES))
+            create_index(c)
+        write_metadata(c, {**header["metadata"], DUMP_KEY: header["sha256"]})
+        conn.commit()
+        on_progress("Verifying", 0, 1)
+        verify(conn, header)
+    finally:
+        conn.close()
+
+
+def build_binary(db_path: str, header: Dict[str, Any], path: str):
+    conn = sqlite3.connect(f"file:{pathname2url(db_path)}?mode=ro", uri=True)
+    try:
+        write_binary(conn, path)
+    finally:
+        conn.close()
+    dictionary = BinaryDictionary(path)
+    try:
+        if len(dictionary) != header["entries"]:
+            raise ValueError(f"The binary dictionary has {len(dictionary)} entries instead of {header['entries']}")
+    finally:
+        dictionary.close()
+
+
+def verify(conn: sqlite3.Connection, header: Dict[str, Any]):
+    if conn.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+        raise ValueError("The built dictionary database is corrupt")
+    digest = hashlib.sha256()
+    for line in dump_lines(conn):
+        digest.update(line.encode("utf8"))
+    if digest.hexdigest() != header["sha256"]:
+        raise ValueError("The built dictionary database does not match the dump")
@@ -0,0 +1,329 @@
+import re
+import heapq
+import random
+import sqlite3
+
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.request import pathname2url
+
+from .binary import BinaryDictionary, binary_path, is_current
+from .lookup import (
+    Cursor,
+    ROW_COLUMNS,
+    Row,
+    batch_groups,
+    batch_lookup,
+    english_mentioned,
+    match_page,
+    normalize_sense,
+    plan_hanzi_query,
+    sense_exists,
+    with_senses,
+)
+from .pinyin import pinyin_query_key, search_pinyin_key
+from .segment import Segmenter
+from .stats import query_stats
+
+asian_characters = re.compile(
+    r"[^\u3041}-\u3096\u30A0-\u30FF\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A\u2E80-\u2FD5\uFF5F-\uFF9F\u3000-\u303F\u31F0-\u31FF\u3220-\u3243\u3280-\u337F]+"
+)
+separators = re.compile(r"[\n，,#%&$/ ]", re.M)
+
+SAMPLE_QUERY = f"SELECT {ROW_COLUMNS} FROM sample_pool s JOIN dictionary d ON d.rowid = s.id WHERE s.pos IN ({{}})"
+
+# Rows per page when all matches of a word are wanted
+LOOKUP_PAGE = 1000
+
+# Prepared statements kept per connection. The batch and IN queries vary with the number of words, so this is
+# well above the default of 128
+CACHED_STATEMENTS = 256
+
+# Pragmas of the read-only connections: map the database file instead of reading it into the page cache, which
+# is then only needed for what does not fit the mapping, and reject writes
+READ_ONLY_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16 * 1024,  # in KiB
+    "query_only": 1,
+}
+
+
+def split_string(s: str) -> List[str]:
+    """
+    Split a string using one of the supported separator characters (newline, comma, hash, percentage, ampersand, dollar, forward slash, space).
+    Each element is then stripped of leading and trailing spaces and filtered to remove non-Chinese characters.
+
+    :param s: a string to be split
+    :return: a list of strings after splitting and processing
+    """
+    return [clean_w for w in separators.split(s) if (clean_w := asian_characters.sub("", w))]
+
+
+def query_words(query: str) -> List[str]:
+    """
+    Split a query as typed into the words to look up. Pinyin queries are kept whole.
+    """
+    return [query] if pinyin_query_key(query) else split_string(query)
+
+
+def open_read_only(db_path: str) -> sqlite3.Connection:
+    """
+    Open the dictionary for lookups only. The dictionary is marked immutable, so SQLite takes no locks and does
+    not check for changes by other connections. It must not be modified while open, tools/database.py only runs
+    while Anki is closed.
+
+    The connection may be closed from another thread, e.g. by ConnectionManager.close_all, but must only be
+    used by one thread at a time.
+    """
+    conn = sqlite3.connect(
+        f"file:{pathname2url(db_path)}?mode=ro&immutable=1", uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS
+    )
+    for name, value in READ_ONLY_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class DictionaryEngine:
+    """
+    The dictionary lookups of the add-on without Qt or Anki: exact and fuzzy searches, batch lookups and
+    segmentation, returning plain tuples.
+
+    An engine holds one read-only connection, which must not be shared between threads. Use one engine per
+    thread or process, see ConnectionManager.
+    """
+
+    # The backend name of the config, cursors of one backend mean nothing to the other
+    backend = "sqlite"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = open_read_only(db_path)
+        self.segmenter: Optional[Segmenter] = None
+
+    def close(self):
+        self.conn.close()
+
+    def interrupt(self):
+        """
+        Abort the running query, it raises an OperationalError. Safe to call from any thread.
+        """
+        self.conn.interrupt()
+
+    def match(self, word: str, exact: bool, limit: int, after: Optional[Cursor] = None) -> Tuple[List[Row], Optional[Cursor]]:
+        """
+        Look up a page of the hanzi, pinyin and English matches of a word, best ranked first.
+
+        :param word: the query as typed, optionally with wildcards
+        :param exact: whether to match whole headwords only
+        :param limit: the number of rows per page
+        :param after: the cursor returned with the previous page, None for the first page
+        :return: the rows of the page, and the cursor of the next page or None if there are no more matches
+        """
+        with query_stats.trace(self.conn, "sql.match"):
+            return match_page(self.conn, word, exact, self.pinyin_key(word), limit, after)
+
+    def pinyin_key(self, word: str) -> Optional[str]:
+        return search_pinyin_key(word, lambda sense: sense_exists(self.conn, sense))
+
+    def mentioned(self, word: str) -> bool:
+        """
+        Whether any sense contains every English word of the query.
+        """
+        with query_stats.trace(self.conn, "sql.mentioned"):
+            return english_mentioned(self.conn, word)
+
+    def lookup(self, word: str, exact: bool) -> Tuple[List[Row], List[str]]:
+        """
+        Look up all hanzi, pinyin and English matches of a word.
+
+        :param word: the query as typed, optionally with wildcards
+        :param exact: whether to match whole headwords only
+        :return: the matches in rank order, and the word if nothing matched
+        """
+        rows, cursor = self.match(word, exact, LOOKUP_PAGE)
+        while cursor is not None:
+            page, cursor = self.match(word, exact, LOOKUP_PAGE, cursor)
+            rows += page
+        skipped = [word] if not rows and not self.mentioned(word) else []
+        return rows, skipped
+
+    def exact(self, word: str) -> List[Row]:
+        return self.lookup(word, True)[0]
+
+    def fuzzy(self, word: str) -> List[Row]:
+        """
+        Headwords containing the word, or starting with it when it ends with a wildcard, and pinyin and English matches.
+        """
+        return self.lookup(word, False)[0]
+
+    def batch(self, words: List[str], exact: bool) -> Tuple[List[Row], List[str]]:
+        """
+        Look up many words at once.
+
+        :return: the matching rows grouped by word in input order, and the words without any match
+        """
+        with query_stats.trace(self.conn, "sql.batch"):
+            return batch_lookup(self.conn, words, exact, [self.pinyin_key(word) for word in words])
+
+    def headwords(self, words: List[str]) -> Dict[str, List[Row]]:
+        """
+        Look up the entries of many hanzi words at once, by traditional or simplified headword.
+
+        :param words: hanzi words, for example segmented text
+        :return: the entries of each word, words without an entry are left out
+        """
+        unique = list(dict.fromkeys(words))
+        with query_stats.trace(self.conn, "sql.headwords"):
+            groups = batch_groups(self.conn, unique, True, [None] * len(unique))
+        entries = {}
+        for word, group in zip(unique, groups):
+            # Words that are also English, e.g. in latin script, match senses as well
+            rows = [row for row in group if word in row[:2]]
+            if rows:
+                entries[word] = rows
+        return entries
+
+    def segment(self, text: str) -> List[str]:
+        """
+        Split a text on the supported separator characters and segment each part into dictionary words.
+        Parts are segmented as they are, so that headwords with Latin letters such as T恤 or 卡拉OK are found,
+        characters that are not Chinese are only dropped when they are not part of a headword.
+        The segmenter is built on first use from all headwords.
+
+        :param text: a text, for example a selected sentence
+        :return: a list of words in the order they appear in the text
+        """
+        if self.segmenter is None:
+            self.segmenter = Segmenter(self.all_headwords())
+        with query_stats.timed("segment"):
+            words = (word for part in separators.split(text) for word in self.segmenter.segment(part))
+            return [word for word in words if word in self.segmenter or not asian_characters.fullmatch(word)]
+
+    def all_headwords(self) -> Iterable[str]:
+        return (hanzi for row in self.conn.execute("SELECT hanzi_simp, hanzi_trad FROM dictionary") for hanzi in row)
+
+    def sample(self, count: int) -> List[Row]:
+        """
+        Pick random entries by position from the precomputed pool of two character words.
+        """
+        with query_stats.trace(self.conn, "sql.sample"):
+            pool_size = self.conn.execute("SELECT COUNT(*) FROM sample_pool").fetchone()[0]
+            positions = random.sample(range(1, pool_size + 1), min(count, pool_size))
+            return with_senses(self.conn, self.conn.execute(SAMPLE_QUERY.format(", ".join("?" * len(positions))), positions).fetchall())
+
+
+def filtered(cursors: Iterator[Cursor], keep: Callable[[int], bool]) -> Iterator[Cursor]:
+    return (cursor for cursor in cursors if keep(cursor[1]))
+
+
+class BinaryEngine(DictionaryEngine):
+    """
+    The same lookups on the memory-mapped binary dictionary written by tools/database.py, without SQLite.
+    Results are in the same order as from the SQLite engine: the index values are stored in rank order, and
+    like the SQLite queries each page merges them from the cursor on and stops one row after the page. Lookups
+    are not interruptible. Only the rows of the page are decoded.
+    """
+
+    backend = "binary"
+
+    def __init__(self, path: str):
+        self.db_path = path
+        self.binary = BinaryDictionary(path)
+        self.segmenter: Optional[Segmenter] = None
+
+    def close(self):
+        self.binary.close()
+
+    def interrupt(self):
+        pass
+
+    def merged(self, sources: Iterable[Tuple[Sequence[int], Optional[Callable[[int], bool]]]], after: Optional[Cursor] = None) -> Iterator[Cursor]:
+        """
+        Merge index values in rank order, each entry once, skipping the entries a source's filter rejects.
+
+        :param sources: the values of an index key, and a filter or None to keep all of them
+        :param after: the cursor of the previous page, only entries ranked after it are yielded
+        """
+        position = None if after is None else after[0]
+        streams = [
+            self.binary.ranked(entries, position) if keep is None else filtered(self.binary.ranked(entries, position), keep)
+            for entries, keep in sources
+        ]
+        previous = None
+        for cursor in heapq.merge(*streams):
+            if cursor != previous:
+                yield cursor
+            previous = cursor
+
+    def hanzi_sources(self, word: str, exact: bool) -> List[Tuple[Sequence[int], Optional[Callable[[int], bool]]]]:
+        kind, term = plan_hanzi_query(word, exact)
+        if not term:
+            return []
+        if kind == "exact":
+            return [(self.binary.trad.get(term), None), (self.binary.simp.get(term), None)]
+        # Every headword starting with or containing the query contains its first one or two characters, like in
+        # the SQLite engine the gram index is read in rank order and filtered
+        grams = self.binary.grams.get(term[:2])
+        if kind == "prefix":
+            return [(grams, lambda entry: any(hanzi.startswith(term) for hanzi in self.binary.headword(entry)))]
+        if len(term) <= 2:
+            return [(grams, None)]
+        return [(grams, lambda entry: any(term in hanzi for hanzi in self.binary.headword(entry)))]
+
+    def pinyin_key(self, word: str) -> Optional[str]:
+        return search_pinyin_key(word, lambda sense: len(self.binary.sense_index.get(sense)) > 0)
+
+    def match(self, word: str, exact: bool, limit: int, after: Optional[Cursor] = None) -> Tuple[List[Row], Optional[Cursor]]:
+        with query_stats.timed("binary.match"):
+            sources = self.hanzi_sources(word, exact)
+            key = self.pinyin_key(word)
+            if key:
+                sources.append((self.binary.pinyin.get(key), None))
+            sense = normalize_sense(word)
+            if sense:
+                sources.append((self.binary.sense_index.get(sense), None))
+            page = list(islice(self.merged(sources, after), limit + 1))
+        cursor = page[limit - 1] if len(page) > limit else None
+        return self.binary.rows(entry for _, entry in page[:limit]), cursor
+
+    def mentioned(self, word: str) -> bool:
+        with query_stats.timed("binary.mentioned"):
+            return self.binary.find_sense(set(normalize_sense(word).split())) is not None
+
+    def batch(self, words: List[str], exact: bool) -> Tuple[List[Row], List[str]]:
+        rows = []
+        skipped = []
+        with query_stats.timed("binary.batch"):
+            for word in words:
+                word_rows, word_skipped = self.lookup(word, exact)
+                rows += word_rows
+                skipped += word_skipped
+        return rows, skipped
+
+    def headwords(self, words: List[str]) -> Dict[str, List[Row]]:
+        entries = {}
+        for word in dict.fromkeys(words):
+            rows = self.binary.rows(entry for _, entry in self.merged(self.hanzi_sources(word, True)))
+            if rows:
+                entries[word] = rows
+        return entries
+
+    def all_headwords(self) -> Iterable[str]:
+        return self.binary.headwords()
+
+    def sample(self, count: int) -> List[Row]:
+        positions = random.sample(range(len(self.binary.sample)), min(count, len(self.binary.sample)))
+        return self.binary.rows(self.binary.sample[position] for position in positions)
+
+
+def open_engine(db_path: str, backend: str) -> DictionaryEngine:
+    """
+    Open the dictionary with the configured backend, "sqlite" or "binary". The binary backend falls back to
+    SQLite when the binary dictionary was not built, or was built by an older version of the add-on.
+
+    :param db_path: the SQLite dictionary, the binary dictionary is expected next to it
+    :param backend: the backend from the add-on config
+    """
+    if backend == "binary" and is_current(binary_path(db_path)):
+        return BinaryEngine(binary_path(db_path))
+    return DictionaryEngine(db_path)
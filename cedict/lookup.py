@@ -0,0 +1,302 @@
+import re
+import json
+
+from sqlite3 import Connection
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# A dictionary entry: traditional, simplified, pinyin, english and the senses the english is joined from
+Row = Tuple[str, str, str, str, Tuple[str, ...]]
+
+# Where a page of results ended, the next page starts after it. Opaque to callers, for the SQLite engine it is
+# the rank and rowid of the last entry of the page
+Cursor = Tuple[int, int]
+
+# Queries select the rowid of each dictionary row first, with_senses replaces it by the senses of the entry.
+# The columns are named, the rank is only selected where it is needed
+ROW_COLUMNS = "d.rowid, d.hanzi_trad, d.hanzi_simp, d.pinyin, d.eng"
+ENGLISH_MENTION_QUERY = "SELECT 1 FROM sense_tokens WHERE token IN ({}) GROUP BY id, ordinal HAVING COUNT(*) = ? LIMIT 1"
+SENSES_QUERY = "SELECT id, text FROM senses WHERE id IN ({}) ORDER BY id, ordinal"
+SENSE_EXISTS_QUERY = "SELECT 1 FROM senses WHERE tokens = ? LIMIT 1"
+
+# Ranked queries select the rank before the rowid and end with a keyset condition on both, so that each page is
+# read in rank order from an index and stops after the rows it needs. The gram and pinyin indexes hold the rank
+# of each entry for this.
+RANKED_EXACT_QUERY = (
+    f"SELECT d.rank, {ROW_COLUMNS} FROM dictionary d WHERE (d.hanzi_trad = ? OR d.hanzi_simp = ?) AND (d.rank, d.rowid) > (?, ?) "
+    "ORDER BY d.rank, d.rowid"
+)
+RANKED_GRAM_QUERY = (
+    f"SELECT g.rank, {ROW_COLUMNS} FROM hanzi_grams g CROSS JOIN dictionary d ON d.rowid = g.id "
+    "WHERE g.gram = ? AND {} AND (g.rank, g.id) > (?, ?) ORDER BY g.rank, g.id"
+)
+RANKED_PINYIN_QUERY = (
+    f"SELECT k.rank, {ROW_COLUMNS} FROM pinyin_keys k CROSS JOIN dictionary d ON d.rowid = k.id "
+    "WHERE k.key = ? AND (k.rank, k.id) > (?, ?) ORDER BY k.rank, k.id"
+)
+RANKED_ENGLISH_QUERY = (
+    f"SELECT DISTINCT d.rank, {ROW_COLUMNS} FROM senses s CROSS JOIN dictionary d ON d.rowid = s.id "
+    "WHERE s.tokens = ? AND (d.rank, d.rowid) > (?, ?) ORDER BY d.rank, d.rowid"
+)
+
+# Ranks order entries by headword length, then by position in the frequency list, then by number of senses,
+# more senses first. Each criterion gets the low bits left over by the previous ones.
+RANK_FREQUENCY_BITS = 24
+RANK_SENSE_BITS = 8
+
+# Row ids per senses query, below SQLite's limit on query parameters
+SENSES_CHUNK = 500
+
+sense_token_pattern = re.compile(r"\w+(?:['-]\w+)*")
+
+# Tone marked vowel to plain vowel and tone number, ü is written v in keys
+tone_marks = {
+    mark: (vowel, str(tone))
+    for vowel, marks in (("a", "āáǎà"), ("e", "ēéěè"), ("i", "īíǐì"), ("o", "ōóǒò"), ("u", "ūúǔù"), ("v", "ǖǘǚǜ"))
+    for tone, mark in enumerate(marks, 1)
+}
+
+
+def normalize_sense(text: str) -> str:
+    """
+    Reduce a sense or an English query to its lowercase words separated by single spaces, so that exact English
+    lookups ignore case, punctuation and spacing. The dictionary builder stores senses in the same form.
+
+    :param text: a sense or a query
+    :return: the normalized tokens
+    """
+    return " ".join(sense_token_pattern.findall(text.lower()))
+
+
+def numbered_syllable(syllable: str) -> str:
+    """
+    Write a lowercase pinyin syllable with a tone number instead of a tone mark, e.g. hǎo as hao3 and lǜ or lu:4
+    as lv4. The neutral tone has no number, so men and men5 are both men.
+    """
+    syllable = syllable.replace("u:", "v").replace("ü", "v")
+    tone = ""
+    letters = []
+    for char in syllable:
+        if char in tone_marks:
+            char, tone = tone_marks[char]
+        elif char.isdigit():
+            tone = char
+            continue
+        if char.isalnum():
+            letters.append(char)
+    return "".join(letters) + (tone if tone != "5" else "")
+
+
+def pinyin_key(pinyin: str) -> str:
+    """
+    Key for indexed pinyin lookups: the syllables with tone numbers and without spaces, e.g. ni3hao3 for
+    "nǐ hǎo" and "ni3 hao3". Pinyin without tones gives the toneless key, e.g. nihao.
+
+    :param pinyin: space separated syllables, with tone marks, tone numbers or without tones
+    """
+    return "".join(numbered_syllable(syllable) for syllable in pinyin.lower().split())
+
+
+def toneless_key(key: str) -> str:
+    return "".join(char for char in key if not char.isdigit())
+
+
+def entry_rank(hanzi_trad: str, hanzi_simp: str, sense_count: int, frequency: Dict[str, int]) -> int:
+    """
+    Rank of an entry in the search results, lower ranks first. Computed when the dictionary is built.
+
+    :param sense_count: the number of senses of the entry
+    :param frequency: the position of each word in a frequency list, words not in the list come after all others
+    """
+    unlisted = (1 << RANK_FREQUENCY_BITS) - 1
+    position = min(frequency.get(hanzi_simp, unlisted), frequency.get(hanzi_trad, unlisted), unlisted)
+    senses = (1 << RANK_SENSE_BITS) - 1 - min(sense_count, (1 << RANK_SENSE_BITS) - 1)
+    return (len(hanzi_trad) << RANK_FREQUENCY_BITS | position) << RANK_SENSE_BITS | senses
+
+
+def with_senses(conn: Connection, rows: Sequence[Tuple]) -> List[Row]:
+    """
+    Replace the leading rowid of dictionary rows by the senses of the entry, in dictionary order.
+
+    :param conn: the dictionary connection
+    :param rows: rowid, traditional, simplified, pinyin and english of each entry
+    :return: the rows with their senses
+    """
+    senses: Dict[int, List[str]] = {}
+    ids = list({row[0] for row in rows})
+    for i in range(0, len(ids), SENSES_CHUNK):
+        chunk = ids[i : i + SENSES_CHUNK]
+        for rowid, text in conn.execute(SENSES_QUERY.format(", ".join("?" * len(chunk))), chunk):
+            senses.setdefault(rowid, []).append(text)
+    return [(*row[1:], tuple(senses.get(row[0], ()))) for row in rows]
+
+
+def plan_hanzi_query(word: str, exact: bool) -> Tuple[str, str]:
+    """
+    Decide how a hanzi query is looked up. Exact mode compares whole headwords, otherwise a trailing wildcard
+    (* or %) asks for headwords starting with the query and anything else for headwords containing it.
+
+    :param word: the query as typed, optionally with wildcards
+    :param exact: whether the exact match checkbox is ticked
+    :return: the lookup kind ("exact", "prefix" or "substring") and the query without wildcards
+    """
+    if exact:
+        return "exact", word
+    term = word.strip("%*")
+    if word[-1:] in "%*" and word[:1] not in "%*":
+        return "prefix", term
+    return "substring", term
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """
+    Return the first string that sorts after every string starting with the prefix, the exclusive upper bound
+    for a range scan on an index.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def match_queries(word: str, exact: bool, pinyin: Optional[str]) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Build the ranked queries of a search: the hanzi query, and the pinyin and English queries where they apply.
+    Each query takes the parameters of the keyset condition after its own.
+
+    :param word: the query as typed, optionally with wildcards
+    :param exact: whether the exact match checkbox is ticked
+    :param pinyin: the pinyin key of the word, or None if it is not pinyin
+    :return: the SQL and the parameters of each query
+    """
+    queries = []
+    kind, term = plan_hanzi_query(word, exact)
+    if term and kind == "exact":
+        queries.append((RANKED_EXACT_QUERY, (term, term)))
+    elif term and kind == "prefix":
+        # Every headword starting with the query contains its first one or two characters, like in substring
+        # searches the gram index is read in rank order and filtered, instead of sorting a whole headword range
+        upper = prefix_upper_bound(term)
+        condition = "((d.hanzi_trad >= ? AND d.hanzi_trad < ?) OR (d.hanzi_simp >= ? AND d.hanzi_simp < ?))"
+        queries.append((RANKED_GRAM_QUERY.format(condition), (term[:2], term, upper, term, upper)))
+    elif term:
+        # Every headword containing the query contains its first one or two characters, which are indexed in hanzi_grams
+        queries.append((RANKED_GRAM_QUERY.format("(instr(d.hanzi_trad, ?) OR instr(d.hanzi_simp, ?))"), (term[:2], term, term)))
+    if pinyin:
+        queries.append((RANKED_PINYIN_QUERY, (pinyin,)))
+    sense = normalize_sense(word)
+    if sense:
+        queries.append((RANKED_ENGLISH_QUERY, (sense,)))
+    return queries
+
+
+def match_page(
+    conn: Connection, word: str, exact: bool, pinyin: Optional[str], limit: int, after: Optional[Cursor] = None
+) -> Tuple[List[Row], Optional[Cursor]]:
+    """
+    Look up a page of the hanzi, pinyin and English matches of a word, in rank order and each entry once.
+    Every query reads at most one row more than the page, so the cost follows the page size rather than the
+    number of matches.
+
+    :param conn: the dictionary connection
+    :param word: the query as typed, optionally with wildcards
+    :param exact: whether the exact match checkbox is ticked
+    :param pinyin: the pinyin key of the word, or None if it is not pinyin
+    :param limit: the number of rows per page
+    :param after: the cursor of the previous page, None for the first page
+    :return: the rows of the page, and the cursor of the next page or None if this is the last one
+    """
+    found: Dict[int, Tuple] = {}
+    for query, params in match_queries(word, exact, pinyin):
+        for row in conn.execute(f"{query} LIMIT ?", (*params, *(after or (-1, -1)), limit + 1)):
+            found[row[1]] = row
+    ranked = sorted(found.values(), key=lambda row: row[:2])
+    page = ranked[:limit]
+    cursor = (page[-1][0], page[-1][1]) if len(ranked) > limit else None
+    return with_senses(conn, [row[1:] for row in page]), cursor
+
+
+# Batch lookups join the words against the indexes, one query per lookup kind. The words are passed as one JSON
+# array of [kind, term, upper, pinyin, sense] arrays and unpacked into the batch_words CTE, since a temporary table
+# cannot be created on the read-only connections
+BATCH_WORDS = (
+    "WITH batch_words(pos, kind, term, upper, pinyin, sense) AS (SELECT key, json_extract(value, '$[0]'), json_extract(value, '$[1]'), "
+    "json_extract(value, '$[2]'), json_extract(value, '$[3]'), json_extract(value, '$[4]') FROM json_each(?)) "
+)
+BATCH_QUERIES = [
+    f"SELECT w.pos, d.rank, {ROW_COLUMNS} FROM batch_words w CROSS JOIN dictionary d ON d.hanzi_trad = w.term OR d.hanzi_simp = w.term "
+    "WHERE w.kind = 'exact'",
+    f"SELECT w.pos, d.rank, {ROW_COLUMNS} FROM batch_words w CROSS JOIN dictionary d "
+    "ON (d.hanzi_trad >= w.term AND d.hanzi_trad < w.upper) OR (d.hanzi_simp >= w.term AND d.hanzi_simp < w.upper) "
+    "WHERE w.kind = 'prefix'",
+    f"SELECT w.pos, d.rank, {ROW_COLUMNS} FROM batch_words w CROSS JOIN hanzi_grams g ON g.gram = substr(w.term, 1, 2) "
+    "CROSS JOIN dictionary d ON d.rowid = g.id "
+    "WHERE w.kind = 'substring' AND (instr(d.hanzi_trad, w.term) OR instr(d.hanzi_simp, w.term))",
+    f"SELECT w.pos, d.rank, {ROW_COLUMNS} FROM batch_words w CROSS JOIN pinyin_keys k ON k.key = w.pinyin CROSS JOIN dictionary d ON d.rowid = k.id",
+    f"SELECT w.pos, d.rank, {ROW_COLUMNS} FROM batch_words w CROSS JOIN senses s ON s.tokens = w.sense CROSS JOIN dictionary d ON d.rowid = s.id",
+]
+
+
+def batch_groups(conn: Connection, words: List[str], exact: bool, pinyin: List[Optional[str]]) -> List[List[Row]]:
+    """
+    Look up many words at once. All matches of one lookup kind are resolved with one query for all words,
+    then the matches of each word are put in rank order like those of match_page.
+
+    :param conn: the dictionary connection
+    :param words: the words to look up
+    :param exact: whether the exact match checkbox is ticked
+    :param pinyin: the pinyin key of each word, or None for words that are not pinyin
+    :return: the matching dictionary rows of each word
+    """
+    entries = []
+    for pos, word in enumerate(words):
+        kind, term = plan_hanzi_query(word, exact)
+        upper = prefix_upper_bound(term) if kind == "prefix" and term else None
+        entries.append([kind if term else None, term, upper, pinyin[pos], normalize_sense(word)])
+    params = (json.dumps(entries, ensure_ascii=False),)
+
+    found: List[Dict[int, Tuple]] = [{} for _ in words]
+    for query in BATCH_QUERIES:
+        for pos, rank, *row in conn.execute(BATCH_WORDS + query, params):
+            found[pos][row[0]] = (rank, *row)
+    ranked = [sorted(word_found.values(), key=lambda row: row[:2]) for word_found in found]
+    rows = with_senses(conn, [row[1:] for word_rows in ranked for row in word_rows])
+    groups = []
+    start = 0
+    for word_rows in ranked:
+        groups.append(rows[start : start + len(word_rows)])
+        start += len(word_rows)
+    return groups
+
+
+def batch_lookup(conn: Connection, words: List[str], exact: bool, pinyin: List[Optional[str]]) -> Tuple[List[Row], List[str]]:
+    """
+    Look up many words at once, see batch_groups.
+
+    :return: the matching dictionary rows grouped by word in input order, and the words without any match
+    """
+    rows = []
+    skipped = []
+    for word, group in zip(words, batch_groups(conn, words, exact, pinyin)):
+        rows.extend(group)
+        if not group and not english_mentioned(conn, word):
+            skipped.append(word)
+    return rows, skipped
+
+
+def sense_exists(conn: Connection, sense: str) -> bool:
+    """
+    Check whether any sense of the dictionary is the given one, as normalized by normalize_sense.
+    """
+    return conn.execute(SENSE_EXISTS_QUERY, (sense,)).fetchone() is not None
+
+
+def english_mentioned(conn: Connection, word: str) -> bool:
+    """
+    Check in the inverted token index whether any sense contains every word of the query. Queries that only
+    appear inside longer senses are not reported as missing.
+
+    :param conn: the dictionary connection
+    :param word: the English query
+    """
+    tokens = set(normalize_sense(word).split())
+    if not tokens:
+        return False
+    query = ENGLISH_MENTION_QUERY.format(", ".join("?" * len(tokens)))
+    return conn.execute(query, (*tokens, len(tokens))).fetchone() is not None
@@ -1,60 +1,81 @@
-import re
 import sys
 
-from sqlite3 import connect
-from typing import List, Optional
-from os.path import dirname, join, realpath
+from itertools import count
+from typing import List, Optional, Sequence
+from os.path import basename, dirname, join, realpath
 
 from aqt import mw
 from aqt.qt import *
 from aqt.editor import Editor
+from aqt.browser import Browser
 from aqt.reviewer import Reviewer
-from aqt.utils import showInfo, tooltip
+from aqt.utils import showInfo, showText, tooltip
 
 from ..forms.dict_ui import Ui_Dialog
-from ..third_party.hanzidentifier import hanzidentifier
+from .cache import QueryCache
 from .config import find_fields, find_tags, save_config, about
-
-# Connect to dictionary database
+from .connections import ConnectionManager
+from .engine import DictionaryEngine, query_words, split_string
+from .lookup import Cursor, Row
+from .notes import Entry, NoteFactory, NoteFiller, add_notes_op, fill_notes_op
+from .results import ResultsModel
+from .search import SearchJob, SearchWorker
+from .stats import query_stats
+from .timing import startup_report, timed
+
+# Dictionary database, connected on first use by each thread that searches it. Released add-ons ship the
+# compressed dump instead, the database is materialized from it in the background on first use
 db_path = join(dirname(realpath(__file__)), "../CC-CEDICT_dictionary.db")
-conn = connect(db_path)
-c = conn.cursor()
+dump_path = join(dirname(realpath(__file__)), "../CC-CEDICT_dictionary.dump.xz")
+connections = ConnectionManager(db_path, dump_path=dump_path)
+
+# Seconds to wait for the search worker to finish its query when the profile is closed
+SHUTDOWN_TIMEOUT = 5
+
+# Search as you type starts once typing pauses for this long
+TYPING_DELAY_MS = 300
+
+# The next page of results is loaded when one of this many last rows comes into view
+LOAD_MORE_ROWS = 20
+
+# Interval of the progress updates while the dictionary is materialized
+BUILD_POLL_MS = 250
+
+# Results of recent searches, shared by all dialogs
+CACHE_MAX_ENTRIES = 1000
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+query_cache = QueryCache(db_path, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
 
 
 def debug(s):
     sys.stdout.write(s + "\n")
 
 
-asian_characters = r"[^\u3041}-\u3096\u30A0-\u30FF\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A\u2E80-\u2FD5\uFF5F-\uFF9F\u3000-\u303F\u31F0-\u31FF\u3220-\u3243\u3280-\u337F]+"
+def get_engine() -> DictionaryEngine:
+    """
+    Return the dictionary engine of the main thread, connecting on first use. Searches run on the search
+    worker's own engine.
+    """
+    return connections.engine()
 
 
-def split_string(s: str) -> List[str]:
+def fill_selected_notes(browser: Browser):
     """
-    Split a string using one of the supported separator characters (newline, comma, hash, percentage, ampersand, dollar, forward slash, space).
-    Each element is then stripped of leading and trailing spaces and filtered to remove non-Chinese characters.
-
-    :param s: a string to be split
-    :return: a list of strings after splitting and processing
+    Fill in the empty pinyin and English fields of the notes selected in the browser from their hanzi field.
     """
-    return [clean_w for w in re.split(r"[\n，,#%&$/ ]", s, 0, re.M) if (clean_w := re.sub(asian_characters, "", w))]
-
-
-def color_tone(pinyin: str):
-    firstTone = "āēīōūǖ"
-    secondTone = "áéíóúǘ"
-    thirdTone = "ǎěǐǒǔǚ"
-    fourthTone = "àèìòùǜ"
-    letters = list(pinyin)
-    for i in letters:
-        if i in firstTone:
-            return f'<span style="color:#ff0000">{pinyin}</span>'
-        if i in secondTone:
-            return f'<span style="color:#d89000">{pinyin}</span>'
-        if i in thirdTone:
-            return f'<span style="color:#00a000">{pinyin}</span>'
-        if i in fourthTone:
-            return f'<span style="color:#0000ff">{pinyin}</span>'
-    return f"<span>{pinyin}</span>"
+    note_ids = browser.selected_notes()
+    if not note_ids:
+        tooltip("No notes selected", parent=browser)
+        return
+    config = mw.addonManager.getConfig(__name__)
+    connections.configure(config["backend"])
+
+    def filled(changed: int, missing: List[str]):
+        tooltip(f"Filled in {changed} of {len(note_ids)} notes", parent=browser)
+        if missing:
+            showInfo("Can't find {} words:\n\t{}".format(len(missing), ",\n".join(missing)), parent=browser)
+
+    fill_notes_op(browser, connections, NoteFiller(config), note_ids, filled).run_in_background()
 
 
 class start_main(QDialog):
@@ -63,13 +84,23 @@ class start_main(QDialog):
         QDialog.__init__(self, parent, Qt.WindowType.Window)
         self.dialog = dialog
         self.dialog.setupUi(self)
-        self.setupUI()
-        self.inputs = []
+        self.results = ResultsModel(self)
+        self.search_worker: Optional[SearchWorker] = None
+        self.search_job: Optional[SearchJob] = None
+        # Where the results of the current single word search continue, None once all are shown
+        self.next_page: Optional[Cursor] = None
+        self.search_ids = count()
+        self.populated = False
+        with timed("dialog"):
+            self.setupUI()
         self.skipped = []
         self.duplicate = []
         self.batch_search_mode = False
+        self.importing = False
 
     def setupUI(self):
+        # Only wiring here, the dialog is created as soon as an editor loads a note. The collection
+        # is read when the dialog is shown for the first time, see populate().
         config = mw.addonManager.getConfig(__name__)
 
         # set icon
@@ -77,24 +108,78 @@ class start_main(QDialog):
         icon.addPixmap(QPixmap(join(dirname(dirname(realpath(__file__))), "designer/icons/icon.png")), QIcon.Mode.Normal, QIcon.State.Off)
         self.setWindowIcon(icon)
 
+        self.dialog.CurrentField.setEnabled(False)
+        self.dialog.AddCurrentField.setEnabled(False)
+
+        # Connect buttons
+        self.dialog.About.clicked.connect(lambda: about(self))
+        self.dialog.StatsButton.clicked.connect(self.show_stats)
+        self.dialog.Add.clicked.connect(self.init_add)
+        self.dialog.Results.clicked.connect(self.tablewidgetclicked)
+        self.dialog.SearchButton.clicked.connect(self.search)
+        self.dialog.ImportButton.clicked.connect(self.import_word_list)
+        self.dialog.Query.returnPressed.connect(self.search)
+        self.dialog.Query.textEdited.connect(self.query_edited)
+        self.dialog.checkBox.stateChanged.connect(self.search)
+
+        # Tooltips
+        self.dialog.Query.setToolTip("Search and import multiple words by separating them with one of those characters: ，,#%&$/")
+        self.dialog.SearchButton.setToolTip("Search and import multiple words by separating them with one of those characters: ，,#%&$/")
+        self.dialog.ImportButton.setToolTip("Search all words of a word list file, e.g. an HSK list. Only the Chinese words of each line are used.")
+        self.dialog.StatsButton.setToolTip("Startup times, and search statistics and slow queries if enabled in the add-on config.")
+        self.dialog.Add.setToolTip("If you searched for multiple words all results will be added, otherwise the entry above will be added.")
+        self.dialog.AddCurrentField.setToolTip(
+            "Add definition to the selected field of the current card.\n (Note must be open in browser or add/edit card menu)."
+        )
+        self.dialog.CurrentField.setToolTip("Select the field to add (append) to.\n (Note must be open in browser or add/edit card menu).")
+
+        # Results table, further pages of results are loaded when it is scrolled to the end
+        self.dialog.Results.setModel(self.results)
+        self.dialog.Results.verticalScrollBar().valueChanged.connect(lambda: self.load_more())
+
+        # Dictionary backend, engines are opened on first use
+        connections.configure(config["backend"])
+
+        # The dictionary is materialized from the dump in the background on first use, searches wait for it and
+        # the progress is shown below the dialog meanwhile
+        self.build_progress = QProgressBar(self)
+        self.build_progress.hide()
+        self.layout().addWidget(self.build_progress, self.layout().rowCount(), 0, 1, -1)
+        self.build_timer = QTimer(self)
+        self.build_timer.setInterval(BUILD_POLL_MS)
+        self.build_timer.timeout.connect(self.check_build)
+        connections.prepare()
+        self.check_build()
+
+        # Instrumentation of the searches, slow queries are also written to the user files of the add-on
+        query_stats.configure(
+            config["query_stats"], config["slow_query_ms"], join(dirname(dirname(realpath(__file__))), "user_files", "slow_queries.log")
+        )
+
+        # Search as you type
+        self.search_as_you_type_enabled = config["search_as_you_type"]
+        self.typing_timer = QTimer(self)
+        self.typing_timer.setSingleShot(True)
+        self.typing_timer.setInterval(TYPING_DELAY_MS)
+        self.typing_timer.timeout.connect(self.search_as_you_type)
+
+        # The tag completer is built or refreshed when the tags field gets focus
+        self.dialog.tags.installEventFilter(self)
+
+        # self.ctrl_s_shortcut = QShortcut(QKeySequence("Ctrl+S"), self)
+        # self.ctrl_s_shortcut.activated.connect()
+
+    def populate(self):
+        config = mw.addonManager.getConfig(__name__)
+        self.populated = True
+
         # Find all decks and add them to dropdown
-        out = mw.col.decks.all()
-        decklist = []
-        for l in out:
-            decklist.append(l["name"])
-        for i in decklist:
-            self.dialog.Deck.addItem(str(i))
+        for deck in mw.col.decks.all_names_and_ids():
+            self.dialog.Deck.addItem(deck.name)
 
         # Find all notetypes and add them to dropdown
-        out = mw.col.models.all()
-        notetypelist = []
-        for l in out:
-            notetypelist.append(l["name"])
-        for i in notetypelist:
-            self.dialog.Notetype.addItem(str(i))
-
-        self.dialog.CurrentField.setEnabled(False)
-        self.dialog.AddCurrentField.setEnabled(False)
+        for notetype in mw.col.models.all_names_and_ids():
+            self.dialog.Notetype.addItem(notetype.name)
 
         # Set current text for config items
         self.dialog.Deck.setCurrentText(config["deck_config"])
@@ -106,15 +191,8 @@ class start_main(QDialog):
         self.dialog.Field4.setCurrentText(config["field_4_config"])
         self.dialog.color_pinyin.setChecked(config["color_pinyin"])
         self.dialog.tags.setText(config["tags"])
-        find_tags(self)
 
-        # Connect buttons
-        self.dialog.About.clicked.connect(lambda: about(self))
-        self.dialog.Add.clicked.connect(self.init_add)
-        self.dialog.Results.clicked.connect(self.tablewidgetclicked)
-        self.dialog.SearchButton.clicked.connect(self.search)
-        self.dialog.Query.returnPressed.connect(self.search)
-        self.dialog.checkBox.stateChanged.connect(self.search)
+        # Save config items when they change
         self.dialog.Field1.currentTextChanged.connect(lambda: save_config(self))
         self.dialog.Field2.currentTextChanged.connect(lambda: save_config(self))
         self.dialog.Field3.currentTextChanged.connect(lambda: save_config(self))
@@ -124,39 +202,36 @@ class start_main(QDialog):
         self.dialog.Notetype.currentTextChanged.connect(lambda: find_fields(self))
         self.dialog.tags.textChanged.connect(lambda: save_config(self))
 
-        # Tooltips
-        self.dialog.Query.setToolTip("Search and import multiple words by separating them with one of those characters: ，,#%&$/")
-        self.dialog.SearchButton.setToolTip("Search and import multiple words by separating them with one of those characters: ，,#%&$/")
-        self.dialog.Add.setToolTip("If you searched for multiple words all results will be added, otherwise the entry above will be added.")
-        self.dialog.AddCurrentField.setToolTip(
-            "Add definition to the selected field of the current card.\n (Note must be open in browser or add/edit card menu)."
-        )
-        self.dialog.CurrentField.setToolTip("Select the field to add (append) to.\n (Note must be open in browser or add/edit card menu).")
+        # Show 10 random entries, picked by position from the precomputed pool of two character words. While the
+        # dictionary is built they are shown once it is done
+        if connections.available():
+            self.show_sample()
 
-        # Align header
-        item = self.dialog.Results.horizontalHeaderItem(0)
-        item.setTextAlignment(Qt.AlignmentFlag.AlignLeft)
-        item = self.dialog.Results.horizontalHeaderItem(1)
-        item.setTextAlignment(Qt.AlignmentFlag.AlignLeft)
-        item = self.dialog.Results.horizontalHeaderItem(2)
-        item.setTextAlignment(Qt.AlignmentFlag.AlignLeft)
-        item = self.dialog.Results.horizontalHeaderItem(3)
-        item.setTextAlignment(Qt.AlignmentFlag.AlignLeft)
-
-        # Show 10 random entries
-        c.execute("SELECT * FROM dictionary WHERE LENGTH(hanzi_trad) ==2  ORDER BY RANDOM() LIMIT 10")
-        result: List[str] = c.fetchall()
-        for row in result:
-            traditional = row[0]
-            simplified = row[1]
-            p = row[2]
-            english = row[3]
-            english = english
-            self.add_result([simplified, traditional, p, english])
+    def show_sample(self):
+        self.add_results(get_engine().sample(10))
         self.first_result()
 
-        # self.ctrl_s_shortcut = QShortcut(QKeySequence("Ctrl+S"), self)
-        # self.ctrl_s_shortcut.activated.connect()
+    def check_build(self):
+        if not connections.ready.is_set():
+            phase, done, total = connections.progress
+            self.build_progress.setFormat(f"Building the dictionary: {phase or 'Starting'} %p%")
+            self.build_progress.setRange(0, max(total, 1))
+            self.build_progress.setValue(done)
+            self.build_progress.show()
+            self.build_timer.start()
+            return
+        self.build_timer.stop()
+        self.build_progress.hide()
+        if connections.build_error is not None:
+            showInfo(f"The dictionary could not be built: {connections.build_error}", parent=self)
+        elif self.populated and not self.results.rowCount() and self.search_job is None:
+            self.show_sample()
+
+    def eventFilter(self, obj: QObject, event: QEvent) -> bool:
+        if obj is self.dialog.tags and event.type() == QEvent.Type.FocusIn:
+            with timed("tags"):
+                find_tags(self)
+        return QDialog.eventFilter(self, obj, event)
 
     def received_editor(self, editor: Editor):
         note = editor.note
@@ -194,108 +269,149 @@ class start_main(QDialog):
                 if "def" in k.lower():
                     self.dialog.CurrentField.setCurrentIndex(i)
 
-    def add_result(self, result: List[str]):
-        rowPosition = self.dialog.Results.rowCount()
-        self.dialog.Results.insertRow(rowPosition)
-        self.dialog.Results.setItem(rowPosition, 0, QTableWidgetItem(str(result[0])))
-        self.dialog.Results.setItem(rowPosition, 1, QTableWidgetItem(str(result[1])))
-        self.dialog.Results.setItem(rowPosition, 2, QTableWidgetItem(str(result[2])))
-        self.dialog.Results.setItem(rowPosition, 3, QTableWidgetItem(str(result[3]).rstrip(", ")))
-
-        font = QFont()
-        font.setFamily("SimHei")
-        font.setPointSize(10)
-        self.dialog.Results.item(rowPosition, 0).setFont(font)
-        self.dialog.Results.item(rowPosition, 1).setFont(font)
-        font.setFamily("Arial")
-        font.setPointSize(8)
-        self.dialog.Results.item(rowPosition, 2).setFont(font)
-        self.dialog.Results.item(rowPosition, 3).setFont(font)
-        self.dialog.Results.resizeColumnsToContents()
-
-    def batch_mode_search(self, words: List[str]):
+    def add_results(self, rows: List[Row]):
+        with query_stats.timed("filter"):
+            added = self.results.add_rows(
+                (simplified, traditional, pinyin, english, senses) for traditional, simplified, pinyin, english, senses in rows
+            )
+        if added:
+            with query_stats.timed("render"):
+                self.dialog.Results.resizeColumnsToContents()
+
+    def get_search_worker(self) -> SearchWorker:
+        if self.search_worker is None:
+            self.search_worker = SearchWorker(
+                connections,
+                query_cache,
+                lambda job, rows: mw.taskman.run_on_main(lambda: self.received_rows(job, rows)),
+                lambda job, skipped, cursor: mw.taskman.run_on_main(lambda: self.search_finished(job, skipped, cursor)),
+                lambda job, e: mw.taskman.run_on_main(lambda: self.search_failed(job, e)),
+                lambda job, done, total: mw.taskman.run_on_main(lambda: self.import_progress(job, done, total)),
+            )
+            self.search_worker.start()
+        return self.search_worker
+
+    def start_search(self, words: List[str], exact: bool, report_skipped: bool):
+        # Runs in the background, a newer search cancels this one
+        words = [word.strip() for word in words]
+        self.finish_import()
+        self.clear_results()
+        self.batch_search_mode = len(words) > 1
+        self.search_job = SearchJob(next(self.search_ids), words, exact, report_skipped)
+        self.get_search_worker().submit(self.search_job)
+
+    def received_rows(self, job: SearchJob, rows: List[Row]):
+        if job is not self.search_job:
+            return
+        first_rows = not self.results.rowCount()
+        self.add_results(rows)
+        if first_rows:
+            self.first_result()
+
+    def import_word_list(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import word list", "", "Text files (*.txt *.csv *.tsv);;All files (*)")
+        if not path:
+            return
+        # Looked up in the background chunk by chunk, results are added to the table as they arrive
+        self.typing_timer.stop()
+        self.finish_import()
+        self.clear_results()
         self.batch_search_mode = True
-        for w in words:
-            self.match(w, self.dialog.checkBox.isChecked())
-
-        if self.skipped:
+        self.dialog.Query.clear()
+        self.search_job = SearchJob(next(self.search_ids), [], True, True, path)
+        self.importing = True
+        mw.progress.start(label=f"Importing {basename(path)}", parent=self)
+        self.get_search_worker().submit(self.search_job)
+
+    def import_progress(self, job: SearchJob, done: int, total: int):
+        if job is self.search_job and self.importing:
+            mw.progress.update(label=f"Importing {basename(job.path)}: {len(self.results.rows)} entries found", value=done, max=total)
+
+    def finish_import(self):
+        if self.importing:
+            self.importing = False
+            mw.progress.finish()
+
+    def search_finished(self, job: SearchJob, skipped: List[str], cursor: Optional[Cursor]):
+        if job is not self.search_job:
+            return
+        self.finish_import()
+        self.skipped = skipped
+        self.next_page = cursor
+        if self.batch_search_mode and job.report_skipped and self.skipped:
             line = "Can't find {} words:\n\t{}".format(len(self.skipped), ",\n".join(self.skipped))
             showInfo(line)
-
-    def match(self, word: str, exact: bool):
-        operator = "=" if exact else "Like"
-        word = word if exact else f"%{word}%"
-        query = f"SELECT * FROM dictionary WHERE hanzi_trad {operator} ? OR hanzi_simp {operator} ? ORDER BY LENGTH(hanzi_trad)"
-        c.execute(query, (word, word))
-        hanzi_results: List[str] = c.fetchall()
-        for row in hanzi_results:
-            traditional = row[0]
-            simplified = row[1]
-            pinyin = row[2]
-            english = row[3]
-            if [simplified, traditional, pinyin, english] not in self.inputs:
-                self.add_result([simplified, traditional, pinyin, english])
-                self.inputs.append([simplified, traditional, pinyin, english])
-
-        c.execute("SELECT * FROM dictionary WHERE eng Like ?", ("%{}%".format(word),))
-        eng_results: List[str] = c.fetchall()
-        for row in eng_results:
-            traditional = row[0]
-            simplified = row[1]
-            pinyin = row[2]
-            english = row[3]
-            english_list = english.split(",")
-            if word in english_list and [simplified, traditional, pinyin, english] not in self.inputs:
-                self.add_result([simplified, traditional, pinyin, english])
-                self.inputs.append([simplified, traditional, pinyin, english])
-
-        if not eng_results and not hanzi_results:
-            self.skipped.append(word)
-        self.first_result()
+        # A page that does not fill the table cannot be scrolled, the next one is loaded right away
+        self.load_more()
+
+    def load_more(self):
+        # The next page of a single word search, once one of the last rows is in view
+        view = self.dialog.Results
+        last_visible = view.rowAt(view.viewport().height() - 1)
+        if self.next_page is None or 0 <= last_visible < self.results.rowCount() - LOAD_MORE_ROWS:
+            return
+        self.search_job = self.search_job._replace(id=next(self.search_ids), after=self.next_page)
+        self.next_page = None
+        self.get_search_worker().submit(self.search_job)
+
+    def search_failed(self, job: SearchJob, e: Exception):
+        if job is self.search_job:
+            self.finish_import()
+            showInfo(f"Search failed: {e}")
+
+    def clear_results(self):
+        self.results.clear()
+        self.next_page = None
+        self.skipped = []
+        self.duplicate = []
+        self.batch_search_mode = False
 
     def search(self):
         query = self.dialog.Query.text()
         if not query:
             return
-        self.dialog.Results.setRowCount(0)
-        self.skipped = []
-        self.inputs = []
-        self.duplicate = []
-        self.batch_search_mode = False
-        words = split_string(query)
+        self.typing_timer.stop()
+        # Pinyin is looked up as a whole, its spaces separate syllables rather than words
+        words = query_words(query)
         self.dialog.Query.setText(", ".join(words))
-        if len(words) > 1:
-            self.batch_mode_search(words)
-            return
+        self.start_search(words if len(words) > 1 else [query], self.dialog.checkBox.isChecked(), True)
+
+    def query_edited(self):
+        if self.search_as_you_type_enabled:
+            self.typing_timer.start()
 
-        self.match(query, self.dialog.checkBox.isChecked())
+    def search_as_you_type(self):
+        # Same as search, but the query is left as typed and missing words are not reported
+        query = self.dialog.Query.text()
+        words = query_words(query)
+        if words:
+            self.start_search(words if len(words) > 1 else [query], self.dialog.checkBox.isChecked(), False)
 
     def search_text(self, selected_text: str):
+        # Selected sentences are segmented into dictionary words, each word is looked up on its own. Until the
+        # dictionary is built, only the separators split them
+        words = get_engine().segment(selected_text) if connections.available() else split_string(selected_text)
+        if len(words) > 1:
+            self.dialog.Query.setText(", ".join(words))
+            self.start_search(words, True, True)
+            return
+
         self.dialog.Query.setText(selected_text)
         self.search()
 
     def tablewidgetclicked(self):
         for idx in self.dialog.Results.selectionModel().selectedIndexes():
             row = idx.row()
-        simp = self.dialog.Results.item(row, 0).text()
-        trad = self.dialog.Results.item(row, 1).text()
-        pinyin = self.dialog.Results.item(row, 2).text()
-        english = self.dialog.Results.item(row, 3).text()
-        self.show_entry(english, pinyin, trad, simp)
+        simp, trad, pinyin, english = self.results.rows[row]
+        self.show_entry(self.results.senses[row], pinyin, trad, simp)
 
     def first_result(self):
-        if self.dialog.Results.rowCount() > 0:
-            simp = self.dialog.Results.item(0, 0).text()
-            trad = self.dialog.Results.item(0, 1).text()
-            pinyin = self.dialog.Results.item(0, 2).text()
-            english = self.dialog.Results.item(0, 3).text()
-            self.show_entry(english, pinyin, trad, simp)
-
-    def show_entry(self, english: str, pinyin: str, trad: str, simp: str):
-        english = english.split(", ")
-        english_entry = ""
-        for i in english:
-            english_entry = f"{english_entry}{i}\n"
+        if self.results.rowCount() > 0:
+            simp, trad, pinyin, english = self.results.rows[0]
+            self.show_entry(self.results.senses[0], pinyin, trad, simp)
+
+    def show_entry(self, senses: Sequence[str], pinyin: str, trad: str, simp: str):
+        english_entry = "".join(f"{sense}\n" for sense in senses)
         if trad != simp:
             self.dialog.Hanzi.setText(f"{trad}/{simp}")
         else:
@@ -303,68 +419,34 @@ class start_main(QDialog):
         self.dialog.Pinyin.setText(pinyin)
         self.dialog.English.setText(english_entry)
 
-    def add_note(self, row: List[str], input_type: str, tags: str):
-        config = mw.addonManager.getConfig(__name__)
-        deck_name = self.dialog.Deck.currentText()
-        did = mw.col.decks.id_for_name(deck_name)
-        note_type_name = self.dialog.Notetype.currentText()
-        nid = mw.col.models.id_for_name(note_type_name)
-        m = mw.col.models.by_name(note_type_name)
-        mw.col.models.set_current(m)
-        # new_note will replace newNote
-        try:
-            n = mw.col.new_note(nid)
-        except:
-            n = mw.col.newNote(forDeck=False)
-        simplified = row[0]
-        pinyin_raw = row[2]
-        traditional = row[1]
-        english = row[3].rstrip(", ")
-
-        if config["color_pinyin"]:
-            pinyin_list = pinyin_raw.split(" ")
-            pinyin = ""
-            for i in pinyin_list:
-                pinyin = f"{pinyin} {color_tone(i)}" if pinyin else f"{pinyin}{color_tone(i)}"
-        else:
-            pinyin = row[2]
-
-        simplified_field_name = config["field_1_config"]
-        n[simplified_field_name] = simplified
-        traditional_field_name = config["field_2_config"]
-        n[traditional_field_name] = traditional
-        pinyin_field_name = config["field_3_config"]
-        n[pinyin_field_name] = pinyin
-        english_field_name = config["field_4_config"]
-        n[english_field_name] = english
-        n.add_tag(tags)
-
-        note_ids_simplified = mw.col.find_notes("{}:{}".format(simplified_field_name, simplified))
-        note_ids_traditional = mw.col.find_notes("{}:{}".format(traditional_field_name, traditional))
-        note_ids_english = mw.col.find_notes(
-            "{}:{}".format(english_field_name, english.replace("or", ""))
-        )  # excluding "or" because it causes errors
-        note_ids = []
-        for i in note_ids_simplified:
-            note_ids.append(i)
-        for i in note_ids_traditional:
-            note_ids.append(i)
-        for i in note_ids_english:
-            note_ids.append(i)
-
-        if note_ids:
-            newline = "\n"
-            showInfo(f"This note already exists:\n{simplified} \t {traditional} \t {pinyin} \t {english.replace(newline, ' ')}")
-            self.duplicate.append([simplified, traditional, pinyin_raw, english])
-        else:
-            mw.col.add_note(n, did)
+    def add_notes(self, rows: List[Entry], input_type: str):
+        factory = NoteFactory(
+            mw.col, mw.addonManager.getConfig(__name__), self.dialog.Deck.currentText(), self.dialog.Notetype.currentText(), self.dialog.tags.text()
+        )
+        mw.col.models.set_current(factory.notetype)
+        add_notes_op(self, factory, rows, self.notes_added).run_in_background()
+
+    def notes_added(self, added_count: int, duplicates: List[Entry]):
+        self.duplicate = duplicates
+        self.show_duplicates()
+        if self.batch_search_mode:
+            tooltip("Added {} notes, skipped: {}, duplicate: {}".format(added_count, len(self.skipped), len(self.duplicate)))
+        elif added_count:
+            tooltip("Added 1 note")
+
+    def show_duplicates(self):
+        newline = "\n"
+        lines = [
+            f"{simplified} \t {traditional} \t {pinyin} \t {english.replace(newline, ' ')}"
+            for simplified, traditional, pinyin, english in self.duplicate
+        ]
+        if len(lines) == 1:
+            showInfo(f"This note already exists:\n{lines[0]}")
+        elif lines:
+            showInfo("These {} notes already exist:\n{}".format(len(lines), "\n".join(lines)))
 
     def add_multiple_notes(self, input_type):
-        tags = self.dialog.tags.text()
-        for row in self.inputs:
-            self.add_note(row, input_type, tags)
-        added_count = len(self.inputs) - len(self.duplicate)
-        tooltip("Added {} notes, skipped: {}, duplicate: {}".format(added_count, len(self.skipped), len(self.duplicate)))
+        self.add_notes(list(self.results.rows), input_type)
 
     def init_add(self):
         config = mw.addonManager.getConfig(__name__)
@@ -377,16 +459,18 @@ class start_main(QDialog):
         if any(used_fields.count(fields) > 1 for fields in used_fields):
             showInfo("Each field can only be used once.")
             return
-        query = self.dialog.Query.text()
-        if hanzidentifier.is_traditional(query):
-            input_type = "hanzi_trad"
-        if hanzidentifier.is_simplified(query):
+        from ..third_party.hanzidentifier import hanzidentifier
+
+        identity = hanzidentifier.identify(self.dialog.Query.text())
+        if identity in (hanzidentifier.SIMPLIFIED, hanzidentifier.BOTH):
             input_type = "hanzi_simp"
-        if not hanzidentifier.is_traditional(query) and not hanzidentifier.is_simplified(query):
+        elif identity == hanzidentifier.TRADITIONAL:
+            input_type = "hanzi_trad"
+        else:
             input_type = "eng"
 
         if self.batch_search_mode:
-            if self.inputs:
+            if self.results.rows:
                 self.add_multiple_notes(input_type)
             return
         else:
@@ -400,27 +484,19 @@ class start_main(QDialog):
 
             pinyin = self.dialog.Pinyin.text()
             english = self.dialog.English.toPlainText().replace("\n", ", ")
-            tags = self.dialog.tags.text()
-            self.add_note([simp, trad, pinyin, english], input_type, tags)
-
-        if [simp, trad, pinyin, english] not in self.duplicate:
-            tooltip("Added 1 note")
+            self.add_notes([(simp, trad, pinyin, english)], input_type)
 
     def editor_add_to_note(self, editor: Editor):
         selected_field = self.dialog.CurrentField.currentText()
 
-        if selected_field and self.dialog.Results.rowCount():
+        if selected_field and self.results.rowCount():
             if not self.dialog.Results.selectionModel().selectedRows():
                 self.dialog.Results.selectRow(0)
             note = editor.note
             text = note[selected_field]
             defs_to_add = []
             for idx in self.dialog.Results.selectionModel().selectedRows():
-                row = idx.row()
-                simp = self.dialog.Results.item(row, 0).text()
-                trad = self.dialog.Results.item(row, 1).text()
-                pinyin = self.dialog.Results.item(row, 2).text()
-                english = self.dialog.Results.item(row, 3).text()
+                simp, trad, pinyin, english = self.results.rows[idx.row()]
 
                 def_to_add = f"【{simp}】【{trad}】{pinyin}<br>{english.replace(', ','/')}"
                 defs_to_add.append(def_to_add)
@@ -439,18 +515,14 @@ class start_main(QDialog):
     def reviewer_add_to_note(self, reviewer: Reviewer):
         selected_field = self.dialog.CurrentField.currentText()
 
-        if selected_field and self.dialog.Results.rowCount():
+        if selected_field and self.results.rowCount():
             if not self.dialog.Results.selectionModel().selectedRows():
                 self.dialog.Results.selectRow(0)
             note = reviewer.card.note()
             text = note[selected_field]
             defs_to_add = []
             for idx in self.dialog.Results.selectionModel().selectedRows():
-                row = idx.row()
-                simp = self.dialog.Results.item(row, 0).text()
-                trad = self.dialog.Results.item(row, 1).text()
-                pinyin = self.dialog.Results.item(row, 2).text()
-                english = self.dialog.Results.item(row, 3).text()
+                simp, trad, pinyin, english = self.results.rows[idx.row()]
 
                 def_to_add = f"【{simp}】【{trad}】{pinyin}<br>{english.replace(', ','/')}"
                 defs_to_add.append(def_to_add)
@@ -469,7 +541,26 @@ class start_main(QDialog):
             reviewer.refresh_if_needed()
             reviewer._redraw_current_card()
 
+    def show_stats(self):
+        cache = f"Cache: {len(query_cache.entries)} searches, {query_cache.hits} hits, {query_cache.misses} misses\n\n"
+        showText(startup_report() + "\n\n" + cache + query_stats.report(), parent=self, title="CC-CEDICT statistics")
+
+    def shutdown(self):
+        """
+        Stop the search worker and close the dialog before the profile is unloaded. The worker releases its
+        engine when it stops.
+        """
+        self.finish_import()
+        if self.search_worker is not None:
+            self.search_worker.stop()
+            self.search_worker.join(SHUTDOWN_TIMEOUT)
+            self.search_worker = None
+        self.close()
+
     def pop_out_dict(self):
+        if not self.populated:
+            with timed("populate"):
+                self.populate()
         self.show()
         self.raise_()
         self.activateWindow()
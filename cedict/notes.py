@@ -0,0 +1,249 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from anki.collection import AddNoteRequest, Collection, OpChanges
+from anki.models import NotetypeDict
+from anki.notes import Note
+from anki.utils import strip_html
+from aqt import mw
+from aqt.operations import CollectionOp
+from aqt.qt import QWidget
+
+from .connections import ConnectionManager
+from .engine import split_string
+from .lookup import Row
+from .stats import query_stats
+
+# Simplified, traditional, pinyin, english
+Entry = Sequence[str]
+
+# Notes built between two progress updates
+PROGRESS_INTERVAL = 100
+
+# Existing notes looked up and updated at a time when filling in their fields
+FILL_CHUNK = 500
+
+
+def color_tone(pinyin: str):
+    firstTone = "āēīōūǖ"
+    secondTone = "áéíóúǘ"
+    thirdTone = "ǎěǐǒǔǚ"
+    fourthTone = "àèìòùǜ"
+    letters = list(pinyin)
+    for i in letters:
+        if i in firstTone:
+            return f'<span style="color:#ff0000">{pinyin}</span>'
+        if i in secondTone:
+            return f'<span style="color:#d89000">{pinyin}</span>'
+        if i in thirdTone:
+            return f'<span style="color:#00a000">{pinyin}</span>'
+        if i in fourthTone:
+            return f'<span style="color:#0000ff">{pinyin}</span>'
+    return f"<span>{pinyin}</span>"
+
+
+def format_pinyin(pinyin: str, color: bool) -> str:
+    """
+    :param pinyin: space separated syllables
+    :param color: whether to color each syllable by its tone
+    """
+    if not color:
+        return pinyin
+    return " ".join(color_tone(syllable) for syllable in pinyin.split(" "))
+
+
+def normalize_field(value: str) -> str:
+    """
+    Reduce a field value to the key used for duplicate detection: without HTML, surrounding whitespace and case.
+    """
+    return strip_html(value).strip().lower()
+
+
+class DuplicateIndex:
+    """
+    Normalized values of the simplified, traditional and English fields of all notes of a notetype.
+
+    The fields are read once for a whole batch of notes, then each candidate is checked with a set lookup per field
+    instead of a collection search. A candidate is a duplicate if any of its fields matches the same field of an
+    existing note, like the searches this replaces.
+    """
+
+    def __init__(self, col: Collection, notetype: NotetypeDict, field_names: Sequence[str]):
+        field_map = col.models.field_map(notetype)
+        self.ords: List[Optional[int]] = [field_map[name][0] if name in field_map else None for name in field_names]
+        self.keys: List[Set[str]] = [set() for _ in field_names]
+        for fields in col.db.list("select flds from notes where mid = ?", notetype["id"]):
+            values = fields.split("\x1f")
+            for keys, ord in zip(self.keys, self.ords):
+                if ord is not None and ord < len(values):
+                    keys.add(normalize_field(values[ord]))
+
+    def is_duplicate(self, values: Sequence[str]) -> bool:
+        """
+        :param values: the candidate's values, in the order of the field names the index was built for
+        """
+        for keys, ord, value in zip(self.keys, self.ords, values):
+            key = normalize_field(value)
+            if ord is not None and key and key in keys:
+                return True
+        return False
+
+    def add(self, values: Sequence[str]):
+        """
+        Record the values of a note added during the batch, so later candidates are checked against it too.
+        """
+        for keys, value in zip(self.keys, values):
+            keys.add(normalize_field(value))
+
+
+class NoteFactory:
+    """
+    Builds notes from dictionary entries. The deck, notetype and field settings are resolved once for a batch.
+    """
+
+    def __init__(self, col: Collection, config: Dict[str, Any], deck_name: str, notetype_name: str, tags: str):
+        self.did = col.decks.id_for_name(deck_name)
+        self.notetype = col.models.by_name(notetype_name)
+        self.simplified_field = config["field_1_config"]
+        self.traditional_field = config["field_2_config"]
+        self.pinyin_field = config["field_3_config"]
+        self.english_field = config["field_4_config"]
+        self.color_pinyin = config["color_pinyin"]
+        self.tags = tags
+
+    def duplicate_index(self, col: Collection) -> DuplicateIndex:
+        return DuplicateIndex(col, self.notetype, [self.simplified_field, self.traditional_field, self.english_field])
+
+    def new_note(self, col: Collection, entry: Entry) -> Note:
+        simplified, traditional, pinyin, english = entry
+        note = col.new_note(self.notetype)
+        note[self.simplified_field] = simplified
+        note[self.traditional_field] = traditional
+        note[self.pinyin_field] = format_pinyin(pinyin, self.color_pinyin)
+        note[self.english_field] = english.rstrip(", ")
+        note.add_tag(self.tags)
+        return note
+
+
+def add_notes_op(parent: QWidget, factory: NoteFactory, entries: List[Entry], on_done: Callable[[int, List[Entry]], None]) -> CollectionOp[OpChanges]:
+    """
+    Add notes for dictionary entries in the background, as a single operation with one undo entry.
+    Entries matching an existing note are skipped.
+
+    :param parent: the window the progress is shown over
+    :param factory: the settings for the new notes
+    :param entries: the entries to add
+    :param on_done: called on the main thread with the number of notes added and the skipped duplicates
+    :return: the operation, ready to run
+    """
+    requests: List[AddNoteRequest] = []
+    duplicates: List[Entry] = []
+
+    def op(col: Collection) -> OpChanges:
+        with query_stats.timed("notes.duplicates"):
+            index = factory.duplicate_index(col)
+        for i, entry in enumerate(entries):
+            if i % PROGRESS_INTERVAL == 0:
+                mw.taskman.run_on_main(lambda i=i: mw.progress.update(label=f"Adding notes {i}/{len(entries)}", value=i, max=len(entries)))
+            simplified, traditional, pinyin, english = entry
+            keys = [simplified, traditional, english.rstrip(", ")]
+            if index.is_duplicate(keys):
+                duplicates.append(entry)
+                continue
+            requests.append(AddNoteRequest(factory.new_note(col, entry), factory.did))
+            index.add(keys)
+        query_stats.increment("notes added", len(requests))
+        query_stats.increment("duplicate notes skipped", len(duplicates))
+        with query_stats.timed("notes.add"):
+            return col.add_notes(requests)
+
+    return CollectionOp(parent, op).success(lambda changes: on_done(len(requests), duplicates)).with_progress(f"Adding {len(entries)} notes")
+
+
+class NoteFiller:
+    """
+    Fills in the empty pinyin and English fields of existing notes from the entries of their hanzi, with the field
+    settings of the add-on. Fields that already have content are kept.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.hanzi_fields = [config["field_1_config"], config["field_2_config"]]
+        self.pinyin_field = config["field_3_config"]
+        self.english_field = config["field_4_config"]
+        self.color_pinyin = config["color_pinyin"]
+
+    def hanzi(self, note: Note) -> str:
+        """
+        The word of a note: the simplified field, or the traditional field if that is empty, without HTML and
+        anything that is not Chinese.
+        """
+        for field in self.hanzi_fields:
+            if field in note:
+                word = "".join(split_string(strip_html(note[field])))
+                if word:
+                    return word
+        return ""
+
+    def empty_fields(self, note: Note) -> List[str]:
+        return [field for field in (self.pinyin_field, self.english_field) if field in note and not strip_html(note[field]).strip()]
+
+    def fill(self, note: Note, rows: List[Row]) -> bool:
+        """
+        :param rows: the entries of the note's word, in rank order
+        :return: whether a field was filled in
+        """
+        fields = self.empty_fields(note)
+        if self.pinyin_field in fields:
+            note[self.pinyin_field] = ", ".join(format_pinyin(pinyin, self.color_pinyin) for pinyin in dict.fromkeys(row[2] for row in rows))
+        if self.english_field in fields:
+            note[self.english_field] = "<br>".join(dict.fromkeys(row[3].rstrip(", ") for row in rows))
+        return bool(fields)
+
+
+def fill_notes_op(
+    parent: QWidget, connections: ConnectionManager, filler: NoteFiller, note_ids: Sequence[int], on_done: Callable[[int, List[str]], None]
+) -> CollectionOp[OpChanges]:
+    """
+    Fill in the pinyin and English fields of existing notes in the background, as a single operation with one
+    undo entry. The notes are read, looked up in one batch and updated a chunk at a time, so memory stays flat for
+    large selections.
+
+    :param parent: the window the progress is shown over
+    :param connections: the dictionary connections, the operation uses and releases one on its own thread
+    :param filler: the field settings
+    :param note_ids: the notes to fill in
+    :param on_done: called on the main thread with the number of notes changed and the words without an entry
+    :return: the operation, ready to run
+    """
+    changed = 0
+    missing: Dict[str, None] = {}
+
+    def op(col: Collection) -> OpChanges:
+        nonlocal changed
+        undo = col.add_custom_undo_entry(f"Fill in {len(note_ids)} notes from CC-CEDICT")
+        engine = connections.engine()
+        try:
+            for start in range(0, len(note_ids), FILL_CHUNK):
+                mw.taskman.run_on_main(lambda i=start: mw.progress.update(label=f"Filling in notes {i}/{len(note_ids)}", value=i, max=len(note_ids)))
+                notes = [note for note in (col.get_note(nid) for nid in note_ids[start : start + FILL_CHUNK]) if filler.empty_fields(note)]
+                words = [filler.hanzi(note) for note in notes]
+                with query_stats.timed("notes.lookup"):
+                    entries = engine.headwords([word for word in words if word])
+                updated = []
+                for note, word in zip(notes, words):
+                    if word not in entries:
+                        if word:
+                            missing[word] = None
+                        continue
+                    if filler.fill(note, entries[word]):
+                        updated.append(note)
+                if updated:
+                    with query_stats.timed("notes.update"):
+                        col.update_notes(updated)
+                    col.merge_undoable_ops(undo)
+                    changed += len(updated)
+        finally:
+            connections.release()
+        query_stats.increment("notes filled in", changed)
+        return col.merge_undoable_ops(undo)
+
+    return CollectionOp(parent, op).success(lambda changes: on_done(changed, list(missing))).with_progress(f"Filling in {len(note_ids)} notes")
@@ -0,0 +1,42 @@
+import re
+
+from typing import Callable, Optional
+
+from ..third_party.zhon import pinyin as zhon
+from .lookup import normalize_sense, pinyin_key, toneless_key
+
+# Longer queries are not checked, ambiguous syllable boundaries make failed matches slow
+MAX_PINYIN_LENGTH = 40
+
+syllable_pattern = re.compile(zhon.syl, re.IGNORECASE)
+# Syllables with tone marks, tone numbers or without tones, optionally separated by spaces, apostrophes or hyphens
+query_pattern = re.compile(f"(?:{zhon.syl})(?:[\\s'-]*(?:{zhon.syl}))*", re.IGNORECASE)
+
+
+def pinyin_query_key(query: str) -> Optional[str]:
+    """
+    Detect a query written in pinyin, such as "ni hao", "ni3 hao3", "nǐhǎo" or "nihao".
+
+    :param query: the query as typed
+    :return: the key to look the query up in the pinyin index, or None if the query is not pinyin
+    """
+    query = query.strip()
+    if len(query) > MAX_PINYIN_LENGTH or not query_pattern.fullmatch(query):
+        return None
+    return pinyin_key(" ".join(syllable_pattern.findall(query)))
+
+
+def search_pinyin_key(query: str, has_sense: Callable[[str], bool]) -> Optional[str]:
+    """
+    The pinyin key a search looks a query up by. Toneless queries that are also a whole English sense, such as
+    "man", "long" or "one", are searched in English only, their many pinyin matches would outrank the English
+    ones. With tone marks or tone numbers, "màn" or "man4", they are searched in pinyin as well.
+
+    :param query: the query as typed
+    :param has_sense: whether a sense of the dictionary is the given normalized sense
+    :return: the key to look the query up in the pinyin index, or None if the query is not searched in pinyin
+    """
+    key = pinyin_query_key(query)
+    if key and key == toneless_key(key) and has_sense(normalize_sense(query)):
+        return None
+    return key
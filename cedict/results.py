@@ -0,0 +1,91 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aqt.qt import *
+
+# Simplified, traditional, pinyin, english
+Entry = Tuple[str, str, str, str]
+
+# An entry followed by its separate senses
+EntryWithSenses = Tuple[str, str, str, str, Tuple[str, ...]]
+
+HEADERS = ["Simplified", "Traditional", "Pinyin", "English"]
+
+
+class ResultsModel(QAbstractTableModel):
+    """
+    Table model for the search results. Rows are kept as tuples in insertion order, with a dict from row to
+    position so that duplicates are dropped in constant time. The view only asks for the rows it displays.
+    The senses of each row are kept alongside for the entry details.
+    """
+
+    def __init__(self, parent: Optional[QObject] = None):
+        QAbstractTableModel.__init__(self, parent)
+        self.rows: List[Entry] = []
+        self.positions: Dict[Entry, int] = {}
+        self.senses: List[Tuple[str, ...]] = []
+
+        self.hanzi_font = QFont()
+        self.hanzi_font.setFamily("SimHei")
+        self.hanzi_font.setPointSize(10)
+        self.latin_font = QFont()
+        self.latin_font.setFamily("Arial")
+        self.latin_font.setPointSize(8)
+        self.header_font = QFont()
+        self.header_font.setFamily("Arial")
+        self.header_font.setPointSize(10)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self.rows[index.row()][index.column()]
+        if role == Qt.ItemDataRole.FontRole:
+            return self.hanzi_font if index.column() < 2 else self.latin_font
+        return None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if orientation != Qt.Orientation.Horizontal:
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            return HEADERS[section]
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            return Qt.AlignmentFlag.AlignLeft
+        if role == Qt.ItemDataRole.FontRole:
+            return self.header_font
+        return None
+
+    def add_rows(self, rows: Iterable[EntryWithSenses]) -> int:
+        """
+        Append rows that are not in the table yet, with a single insert notification for the view.
+
+        :param rows: the rows to append
+        :return: the number of rows appended
+        """
+        new_rows = []
+        new_senses = []
+        for row in rows:
+            entry = (row[0], row[1], row[2], row[3].rstrip(", "))
+            if entry not in self.positions:
+                self.positions[entry] = len(self.rows) + len(new_rows)
+                new_rows.append(entry)
+                new_senses.append(row[4])
+        if new_rows:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+            self.rows.extend(new_rows)
+            self.senses.extend(new_senses)
+            self.endInsertRows()
+        return len(new_rows)
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.positions = {}
+        self.senses = []
+        self.endResetModel()
@@ -0,0 +1,114 @@
+from sqlite3 import Cursor
+from typing import Dict, List, Set, Tuple
+
+from .lookup import entry_rank, normalize_sense, pinyin_key, toneless_key
+
+# Traditional, simplified, pinyin, senses
+Entry = Tuple[str, str, str, Tuple[str, ...]]
+
+
+def tune_for_bulk_load(c: Cursor):
+    # Builds write a new file that only replaces the database once complete, so durability is not needed
+    c.execute("PRAGMA journal_mode = OFF")
+    c.execute("PRAGMA synchronous = OFF")
+    c.execute("PRAGMA cache_size = -262144")
+    c.execute("PRAGMA temp_store = MEMORY")
+
+
+def create_table(c: Cursor):
+    # Results are ordered by the precomputed rank of each entry, see entry_rank
+    c.execute("CREATE TABLE IF NOT EXISTS dictionary(hanzi_trad TEXT, hanzi_simp TEXT, pinyin TEXT, eng TEXT, rank INTEGER)")
+    # The frequency list of the build, kept so that updates rank new entries the same way
+    c.execute("CREATE TABLE IF NOT EXISTS frequency(word TEXT PRIMARY KEY, pos INTEGER) WITHOUT ROWID")
+    # Each sense of an entry with its normalized tokens, and an inverted index from token to sense
+    c.execute("CREATE TABLE IF NOT EXISTS senses(id INTEGER, ordinal INTEGER, text TEXT, tokens TEXT, PRIMARY KEY (id, ordinal)) WITHOUT ROWID")
+    c.execute("CREATE TABLE IF NOT EXISTS sense_tokens(token TEXT, id INTEGER, ordinal INTEGER)")
+
+
+def create_sense_indexes(c: Cursor):
+    # Exact English lookups are equality lookups on the normalized senses
+    c.execute("CREATE INDEX IF NOT EXISTS senses_tokens ON senses(tokens)")
+    # Indexing the tokens after loading is much faster than growing the index in file order
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS sense_tokens_token ON sense_tokens(token, id, ordinal)")
+
+
+def create_hanzi_indexes(c: Cursor):
+    # B-tree indexes for exact and prefix lookups on the headwords
+    c.execute("CREATE INDEX IF NOT EXISTS dictionary_hanzi_trad ON dictionary(hanzi_trad)")
+    c.execute("CREATE INDEX IF NOT EXISTS dictionary_hanzi_simp ON dictionary(hanzi_simp)")
+
+    # Character unigrams and bigrams of both headwords, used for "contains" and prefix lookups. Each gram's
+    # entries are in rank order, so that the best matches are read first
+    c.execute("CREATE TABLE IF NOT EXISTS hanzi_grams(gram TEXT, rank INTEGER, id INTEGER, PRIMARY KEY (gram, rank, id)) WITHOUT ROWID")
+    grams = set()
+    for rowid, rank, hanzi_trad, hanzi_simp in c.execute("SELECT rowid, rank, hanzi_trad, hanzi_simp FROM dictionary").fetchall():
+        grams.update(entry_grams(rowid, rank, hanzi_trad, hanzi_simp))
+    c.executemany("INSERT INTO hanzi_grams (gram, rank, id) VALUES(?, ?, ?)", grams)
+
+
+def entry_grams(rowid: int, rank: int, hanzi_trad: str, hanzi_simp: str) -> Set[Tuple[str, int, int]]:
+    grams = set()
+    for hanzi in (hanzi_trad, hanzi_simp):
+        grams.update((gram, rank, rowid) for gram in hanzi)
+        grams.update((hanzi[i : i + 2], rank, rowid) for i in range(len(hanzi) - 1))
+    return grams
+
+
+def create_pinyin_index(c: Cursor):
+    # Numbered and toneless keys of each entry's pinyin, without spaces, e.g. ni3hao3 and nihao, in rank order
+    c.execute("CREATE TABLE IF NOT EXISTS pinyin_keys(key TEXT, rank INTEGER, id INTEGER, PRIMARY KEY (key, rank, id)) WITHOUT ROWID")
+    keys = set()
+    for rowid, rank, p in c.execute("SELECT rowid, rank, pinyin FROM dictionary").fetchall():
+        keys.update(entry_pinyin_keys(rowid, rank, p))
+    c.executemany("INSERT INTO pinyin_keys (key, rank, id) VALUES(?, ?, ?)", keys)
+
+
+def entry_pinyin_keys(rowid: int, rank: int, p: str) -> Set[Tuple[str, int, int]]:
+    key = pinyin_key(p)
+    return {(key, rank, rowid), (toneless_key(key), rank, rowid)}
+
+
+def create_sample_pool(c: Cursor):
+    # Two character words the add-on picks its sample entries from, by random position
+    c.execute("CREATE TABLE IF NOT EXISTS sample_pool(pos INTEGER PRIMARY KEY, id INTEGER)")
+    c.execute("DELETE FROM sample_pool")
+    c.execute("INSERT INTO sample_pool (id) SELECT rowid FROM dictionary WHERE LENGTH(hanzi_trad) = 2")
+
+
+# Built in this order once all entries are loaded
+INDEXES = [create_hanzi_indexes, create_pinyin_index, create_sense_indexes, create_sample_pool]
+
+
+def write_metadata(c: Cursor, info: Dict[str, str]):
+    # Records which release the database was built or last updated from
+    c.execute("CREATE TABLE IF NOT EXISTS metadata(key TEXT PRIMARY KEY, value TEXT)")
+    c.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES(?, ?)", info.items())
+
+
+def insert_entries(c: Cursor, entries: List[Entry], rowid: int, frequency: Dict[str, int]) -> int:
+    """
+    Insert entries with consecutive row ids, together with their senses. The english column joins the senses.
+
+    :param rowid: the row id before the first entry's
+    :param frequency: the frequency list the ranks are computed with
+    :return: the last row id used
+    """
+    rows = []
+    senses = []
+    tokens = []
+    for hanzi_trad, hanzi_simp, p, entry_senses in entries:
+        rowid += 1
+        rows.append((rowid, hanzi_trad, hanzi_simp, p, ", ".join(entry_senses), entry_rank(hanzi_trad, hanzi_simp, len(entry_senses), frequency)))
+        sense_rows(rowid, entry_senses, senses, tokens)
+    c.executemany("INSERT INTO dictionary (rowid, hanzi_trad, hanzi_simp, pinyin , eng, rank) VALUES(?, ?, ?, ?, ?, ?)", rows)
+    c.executemany("INSERT INTO senses (id, ordinal, text, tokens) VALUES(?, ?, ?, ?)", senses)
+    c.executemany("INSERT INTO sense_tokens (token, id, ordinal) VALUES(?, ?, ?)", tokens)
+    return rowid
+
+
+def sense_rows(rowid: int, entry_senses: Tuple[str, ...], senses: list, tokens: list):
+    # Appends the rows of the senses table and of the inverted index, each token once per sense
+    for ordinal, text in enumerate(entry_senses):
+        normalized = normalize_sense(text)
+        senses.append((rowid, ordinal, text, normalized))
+        tokens.extend((token, rowid, ordinal) for token in dict.fromkeys(normalized.split()))
@@ -0,0 +1,163 @@
+import os
+import threading
+
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from .cache import QueryCache
+from .connections import ConnectionManager
+from .engine import DictionaryEngine
+from .lookup import Cursor, Row
+from .stats import query_stats
+from .wordlist import read_word_chunks
+
+# Rows per page of a single word search, more pages are loaded when the results are scrolled to the end
+PAGE_SIZE = 100
+
+# Words of an imported word list looked up at a time
+IMPORT_CHUNK = 500
+
+# Seconds between checks for a stop while the first search waits for the dictionary to be built
+READY_POLL = 0.1
+
+
+class SearchJob(NamedTuple):
+    id: int
+    words: List[str]
+    exact: bool
+    report_skipped: bool
+    # A word list file to look up instead of the words
+    path: Optional[str] = None
+    # Where the previous page of a single word search ended, None for the first page
+    after: Optional[Cursor] = None
+
+
+class SearchWorker(threading.Thread):
+    """
+    Runs searches on a background thread with its own dictionary engine from the connection manager, opened for
+    the first search and released when the worker stops.
+
+    Only the latest submitted search matters: submitting a new one interrupts the running query and the results
+    of older searches are dropped. Results are passed to the callbacks from the worker thread, so the callbacks
+    have to move them to the main thread themselves. A single word search looks up one page of results and
+    passes the cursor of the next page to on_done, batch searches look up everything. Finished searches are
+    kept in the cache, keyed by the backend, the words, the exact flag and the page. Word list imports are read
+    and looked up chunk by chunk and are not cached.
+    """
+
+    def __init__(
+        self,
+        connections: ConnectionManager,
+        cache: QueryCache,
+        on_rows: Callable[[SearchJob, List[Row]], None],
+        on_done: Callable[[SearchJob, List[str], Optional[Cursor]], None],
+        on_error: Callable[[SearchJob, Exception], None],
+        on_progress: Callable[[SearchJob, int, int], None],
+    ):
+        threading.Thread.__init__(self, name="cedict-search", daemon=True)
+        self.connections = connections
+        self.cache = cache
+        self.on_rows = on_rows
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.engine: Optional[DictionaryEngine] = None
+        self.condition = threading.Condition()
+        self.pending: Optional[SearchJob] = None
+        self.latest = -1
+        self.stopped = False
+
+    def submit(self, job: SearchJob):
+        with self.condition:
+            self.pending = job
+            self.latest = job.id
+            if self.engine:
+                self.engine.interrupt()
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            if self.engine:
+                self.engine.interrupt()
+            self.condition.notify()
+
+    def is_stale(self, job: SearchJob) -> bool:
+        return job.id != self.latest or self.stopped
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                job, self.pending = self.pending, None
+            try:
+                if self.engine is None and not self.open_engine():
+                    continue
+                with query_stats.timed("search.import" if job.path else "search"):
+                    self.run_job(job)
+            except Exception as e:
+                # Interrupted queries raise an OperationalError, which only matters if the search is still wanted
+                if not self.is_stale(job):
+                    self.on_error(job, e)
+        # Interrupting a closed connection fails, the engine is dropped before it is released
+        with self.condition:
+            self.engine = None
+        self.connections.release()
+
+    def open_engine(self) -> bool:
+        """
+        Open the engine for the first search. The dictionary may still be materialized from the dump, stopping
+        the worker ends the wait.
+
+        :return: whether the engine is open, False if the worker was stopped first
+        """
+        while not self.connections.wait(READY_POLL):
+            if self.stopped:
+                return False
+        engine = self.connections.engine()
+        with self.condition:
+            self.engine = engine
+        return True
+
+    def run_job(self, job: SearchJob):
+        if job.path:
+            self.run_import(job)
+            return
+        key = (self.engine.backend, tuple(job.words), job.exact, job.after)
+        self.cache.validate()
+        cached = self.cache.get(key)
+        query_stats.increment("searches")
+        if cached is not None:
+            query_stats.increment("searches from cache")
+            rows, skipped, cursor = cached
+            self.on_rows(job, rows)
+            self.on_done(job, skipped, cursor)
+            return
+
+        if len(job.words) > 1:
+            rows, skipped = self.engine.batch(job.words, job.exact)
+            cursor = None
+        else:
+            word = job.words[0]
+            rows, cursor = self.engine.match(word, job.exact, PAGE_SIZE, job.after)
+            skipped = [word] if job.after is None and not rows and not self.engine.mentioned(word) else []
+        if self.is_stale(job):
+            return
+        self.on_rows(job, rows)
+        self.cache.put(key, (rows, skipped, cursor))
+        self.on_done(job, skipped, cursor)
+
+    def run_import(self, job: SearchJob):
+        # Words repeat in word lists, each missing word is reported once
+        skipped: Dict[str, None] = {}
+        total = os.path.getsize(job.path)
+        for words, done in read_word_chunks(job.path, IMPORT_CHUNK):
+            rows, chunk_skipped = self.engine.batch(words, job.exact)
+            if self.is_stale(job):
+                return
+            skipped.update(dict.fromkeys(chunk_skipped))
+            self.on_rows(job, rows)
+            self.on_progress(job, done, total)
+        self.on_done(job, list(skipped), None)
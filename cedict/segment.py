@@ -0,0 +1,59 @@
+from typing import Dict, Iterable, List
+
+
+class Segmenter:
+    """
+    Splits Chinese text into dictionary words with forward maximum matching.
+
+    The headwords are kept in a prefix dictionary (a flattened trie): every prefix of every headword is a key,
+    and the value tells whether the prefix is a headword itself. Matching at a position stops as soon as the
+    text read so far is not a prefix of any headword.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.prefixes: Dict[str, bool] = {}
+        for word in words:
+            for i in range(1, len(word)):
+                self.prefixes.setdefault(word[:i], False)
+            self.prefixes[word] = True
+
+    def __contains__(self, word: str) -> bool:
+        return self.prefixes.get(word, False)
+
+    def longest_match(self, text: str, start: int) -> int:
+        """
+        Find the end of the longest headword starting at a position.
+
+        :param text: the text to match in
+        :param start: the position the headword has to start at
+        :return: the end index of the headword, or start if no headword starts there
+        """
+        end = start
+        for i in range(start + 1, len(text) + 1):
+            is_word = self.prefixes.get(text[start:i])
+            if is_word is None:
+                break
+            if is_word:
+                end = i
+        return end
+
+    def segment(self, text: str) -> List[str]:
+        """
+        Segment a text into the longest headwords, reading from left to right.
+        Characters that don't start a headword are returned on their own, whitespace and punctuation is dropped.
+
+        :param text: the text to segment
+        :return: a list of words in the order they appear in the text
+        """
+        words = []
+        i = 0
+        while i < len(text):
+            end = self.longest_match(text, i)
+            if end > i:
+                words.append(text[i:end])
+                i = end
+            else:
+                if text[i].isalnum():
+                    words.append(text[i])
+                i += 1
+        return words
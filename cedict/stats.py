@@ -0,0 +1,197 @@
+import os
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from sqlite3 import Connection
+from time import perf_counter
+from typing import ContextManager, Deque, Dict, Iterator, List, Optional
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket holds everything slower
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+# Slow queries kept for the stats view, older ones are only in the log file
+RECENT_SLOW_QUERIES = 20
+
+
+class Histogram:
+    """
+    Count and latency distribution of one phase.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate a percentile as the upper bound of the bucket it falls in.
+
+        :param q: the percentile between 0 and 1
+        """
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+class QueryTrace:
+    """
+    Times a phase that runs SQL and records the statements it executes, to log them if the phase is slow.
+    """
+
+    def __init__(self, stats: "QueryStats", conn: Connection, phase: str):
+        self.stats = stats
+        self.conn = conn
+        self.phase = phase
+        self.statements: List[str] = []
+        self.started = 0.0
+
+    def __enter__(self) -> "QueryTrace":
+        self.conn.set_trace_callback(self.statements.append)
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        ms = (perf_counter() - self.started) * 1000
+        self.conn.set_trace_callback(None)
+        self.stats.record(self.phase, ms)
+        if ms >= self.stats.slow_ms:
+            self.stats.log_slow(self.conn, self.phase, ms, self.statements)
+
+
+class NoTrace:
+    def __enter__(self) -> "NoTrace":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class QueryStats:
+    """
+    Counters and latency histograms of the search phases, and a log of slow SQL with the query plans.
+
+    Disabled by default, then every hook is a single flag check. The search worker and the dialog record from
+    different threads, so updates are serialized by a lock.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = 200.0
+        self.log_path: Optional[str] = None
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.slow_queries: Deque[str] = deque(maxlen=RECENT_SLOW_QUERIES)
+        self.lock = threading.Lock()
+
+    def configure(self, enabled: bool, slow_ms: float, log_path: Optional[str]):
+        """
+        :param enabled: whether to record anything
+        :param slow_ms: phases taking at least this long have their SQL logged
+        :param log_path: the slow query log file, None to only keep the recent slow queries in memory
+        """
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        if enabled and log_path:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    def record(self, phase: str, ms: float):
+        with self.lock:
+            self.histograms.setdefault(phase, Histogram()).add(ms)
+
+    def increment(self, counter: str, n: int = 1):
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] = self.counters.get(counter, 0) + n
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        """
+        Add the time spent in the block to the histogram of a phase.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, (perf_counter() - start) * 1000)
+
+    def trace(self, conn: Connection, phase: str) -> ContextManager:
+        """
+        Time a phase that runs SQL on a connection, logging its statements if it is slow.
+        The connection must not be used by another thread meanwhile.
+        """
+        return QueryTrace(self, conn, phase) if self.enabled else NoTrace()
+
+    def log_slow(self, conn: Connection, phase: str, ms: float, statements: List[str]):
+        lines = [f"{datetime.now():%Y-%m-%d %H:%M:%S} {phase} {ms:.1f} ms"]
+        for statement in statements:
+            lines.append(f"  {statement}")
+            if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                lines.extend(f"    {step}" for step in query_plan(conn, statement))
+        entry = "\n".join(lines)
+        with self.lock:
+            self.slow_queries.append(entry)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf8") as f:
+                    f.write(entry + "\n")
+
+    def report(self) -> str:
+        """
+        The counters, a table of the phase latencies and the recent slow queries, as plain text.
+        """
+        if not self.enabled:
+            return 'Statistics are disabled. Set "query_stats" to true in the add-on config to record them.'
+        with self.lock:
+            lines = [f"{name}: {n}" for name, n in sorted(self.counters.items())]
+            header = "".join(f"{'<=' + str(bound):>7}" for bound in BUCKETS_MS) + f"{'>' + str(BUCKETS_MS[-1]):>7}"
+            lines += ["", f"{'phase (ms)':<16}{'count':>7}{'mean':>9}{'p50':>7}{'p95':>7}{'max':>9}{header}"]
+            for phase, histogram in sorted(self.histograms.items()):
+                mean = histogram.total_ms / histogram.count
+                buckets = "".join(f"{n:>7}" for n in histogram.buckets)
+                lines.append(
+                    f"{phase:<16}{histogram.count:>7}{mean:>9.1f}{histogram.percentile(0.5):>7.0f}"
+                    f"{histogram.percentile(0.95):>7.0f}{histogram.max_ms:>9.1f}{buckets}"
+                )
+            if self.slow_queries:
+                lines += ["", f"Slow queries (at least {self.slow_ms:.0f} ms):"] + list(self.slow_queries)
+        return "\n".join(lines)
+
+
+def query_plan(conn: Connection, statement: str) -> List[str]:
+    """
+    Describe how SQLite runs a statement, one step per line indented by its depth in the plan.
+    """
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    except Exception as e:
+        return [f"no query plan: {e}"]
+    depths = {0: 0}
+    steps = []
+    for id, parent, _, detail in plan:
+        depths[id] = depths.get(parent, 0) + 1
+        steps.append("  " * (depths[id] - 1) + detail)
+    return steps
+
+
+# Shared by the dialog and the search worker, configured when the dialog is created
+query_stats = QueryStats()
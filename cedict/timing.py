@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator
+
+# Milliseconds spent in each startup phase, in the order the phases first ran
+startup_times: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to a startup phase.
+
+    :param phase: the name of the phase in the report
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        startup_times[phase] = startup_times.get(phase, 0.0) + (perf_counter() - start) * 1000
+
+
+def startup_report() -> str:
+    return "CC-CEDICT startup: " + ", ".join(f"{phase} {ms:.1f} ms" for phase, ms in startup_times.items())
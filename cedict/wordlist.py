@@ -0,0 +1,47 @@
+import re
+
+from typing import Dict, Iterator, List, Tuple
+
+# Runs of hanzi and kana, anything else in a word list (pinyin, definitions, numbering, separators) is skipped
+word_pattern = re.compile(
+    r"[\u3041-\u3096\u30A0-\u30FF\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A\u2E80-\u2FD5\uFF5F-\uFF9F\u31F0-\u31FF\u3220-\u3243\u3280-\u337F]+"
+)
+
+
+def read_word_chunks(path: str, chunk_size: int) -> Iterator[Tuple[List[str], int]]:
+    """
+    Stream the words of a word list file in chunks, so that large lists are never held in memory at once.
+    Each line may hold several words, for example a word followed by its pinyin and definition.
+
+    :param path: a UTF-8 text file
+    :param chunk_size: the number of words per chunk
+    :return: the chunks of words in file order, each with the number of bytes read so far
+    """
+    words: List[str] = []
+    done = 0
+    with open(path, "rb") as f:
+        for line in f:
+            done += len(line)
+            words.extend(word_pattern.findall(line.decode("utf-8-sig", errors="replace")))
+            while len(words) >= chunk_size:
+                yield words[:chunk_size], done
+                words = words[chunk_size:]
+    if words:
+        yield words, done
+
+
+def read_frequency_list(path: str) -> Dict[str, int]:
+    """
+    Read a word frequency list, most frequent word first. The first word of each line is taken, so lists with
+    counts, pinyin or numbering on the same line work as they are.
+
+    :param path: a UTF-8 text file
+    :return: the position of each word in the list, starting at 0
+    """
+    positions: Dict[str, int] = {}
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            word = word_pattern.search(line)
+            if word:
+                positions.setdefault(word.group(), len(positions))
+    return positions
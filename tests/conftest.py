@@ -0,0 +1,26 @@
+"""
+The add-on imports its vendored libraries relatively (from ..third_party), so cedict cannot be imported as a
+top-level package. The add-on folder is loaded as a package with the Anki stubs of the benchmarks instead, and its
+modules are registered under the names the tests import them by.
+
+The package is named after the folder, which is also the name pytest imports the folder's __init__.py by. That
+file registers the add-on with Anki, pytest finds it already imported and does not run it.
+"""
+
+import importlib
+import pkgutil
+import sys
+
+from os.path import abspath, basename, dirname, join
+
+root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, join(root, "benchmarks"))
+
+import stubs  # noqa: E402
+
+package = stubs.load_addon(root, basename(root))
+sys.modules[package].__file__ = join(root, "__init__.py")
+for name in ["cedict", "third_party", "third_party.hanzidentifier", "third_party.hanzidentifier.hanzidentifier"]:
+    sys.modules[name] = importlib.import_module(f"{package}.{name}")
+for module in pkgutil.iter_modules([join(root, "cedict")]):
+    sys.modules[f"cedict.{module.name}"] = importlib.import_module(f"{package}.cedict.{module.name}")
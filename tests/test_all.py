@@ -1,6 +1,251 @@
-from cedict.main import split_string
+import sqlite3
+import subprocess
+import sys
+
+from collections import Counter
+from os.path import abspath, dirname, join
+
+from cedict.cache import QueryCache
+from cedict.binary import write_binary
+from cedict.dump import dump_lines, materialize, write_dump
+from cedict.engine import BinaryEngine, DictionaryEngine, split_string
+from cedict.lookup import entry_rank, normalize_sense, pinyin_key, plan_hanzi_query, toneless_key
+from cedict.schema import INDEXES, create_table, insert_entries, write_metadata
+from cedict.segment import Segmenter
+from cedict.stats import Histogram
+from cedict.wordlist import read_frequency_list, read_word_chunks
+from third_party.hanzidentifier import hanzidentifier
 
 
 def test_split_string():
-    r = split_string(" a ,b， 词 ，c#d$e/f\nX")
-    assert r == ["a", "b", "词", "c", "d", "e", "f", "X"]
+    r = split_string(" 爱 ,你好， 词 ，中#国$人/民\n的")
+    assert r == ["爱", "你好", "词", "中", "国", "人", "民", "的"]
+    # Anything that is not Chinese is dropped, parts left empty are skipped
+    assert split_string("a ,b，词x ，c#d$e/f\nX") == ["词"]
+
+
+def test_normalize_sense():
+    assert normalize_sense("To  be fond of (sth)") == "to be fond of sth"
+    assert normalize_sense("you (informal, as opposed to courteous)") == "you informal as opposed to courteous"
+    assert normalize_sense("People's Republic, well-known") == "people's republic well-known"
+
+
+def test_pinyin_key():
+    assert pinyin_key("nǐ hǎo") == pinyin_key("ni3 hao3") == "ni3hao3"
+    assert pinyin_key("wǒ men") == pinyin_key("wo3 men5") == "wo3men"
+    assert pinyin_key("lǜ") == pinyin_key("lu:4") == "lv4"
+    assert toneless_key(pinyin_key("Zhōng guó")) == pinyin_key("zhong guo") == "zhongguo"
+
+
+def test_plan_hanzi_query():
+    assert plan_hanzi_query("一%", True) == ("exact", "一%")
+    assert plan_hanzi_query("中国", False) == ("substring", "中国")
+    assert plan_hanzi_query("%一%", False) == ("substring", "一")
+    assert plan_hanzi_query("中*", False) == ("prefix", "中")
+
+
+def test_entry_rank():
+    frequency = {"学生": 0, "學": 1}
+    assert entry_rank("學", "学", 1, frequency) < entry_rank("學生", "学生", 1, frequency)
+    assert entry_rank("學生", "学生", 1, frequency) < entry_rank("中國", "中国", 5, frequency)
+    assert entry_rank("中國", "中国", 5, frequency) < entry_rank("中國", "中国", 1, frequency)
+
+
+def test_segmenter():
+    s = Segmenter(["中国", "中国人", "人", "我", "是", "学生", "学"])
+    assert s.segment("我是中国人。") == ["我", "是", "中国人"]
+    assert s.segment("中学生") == ["中", "学生"]
+
+
+def test_query_cache(tmp_path):
+    cache = QueryCache(str(tmp_path / "dictionary.db"), 2, 10**6)
+    cache.put(("一",), [("一", "一", "yī", "one")])
+    cache.put(("二",), [])
+    assert cache.get(("一",)) is not None
+    cache.put(("三",), [])
+    assert cache.get(("二",)) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1 and cache.stats()["entries"] == 2
+    cache.validate()
+    assert cache.stats()["entries"] == 2
+    # Building the binary dictionary next to the database changes what the binary backend returns
+    (tmp_path / "dictionary.bin").write_bytes(b"")
+    cache.validate()
+    assert cache.stats()["entries"] == 0
+
+
+def test_read_word_chunks(tmp_path):
+    path = tmp_path / "hsk.txt"
+    path.write_text("1\t爱\tài\tlove\n喜欢 xǐhuan, 中国\n", encoding="utf-8")
+    assert [words for words, done in read_word_chunks(str(path), 2)] == [["爱", "喜欢"], ["中国"]]
+
+
+def test_read_frequency_list(tmp_path):
+    path = tmp_path / "frequency.txt"
+    path.write_text("的\t1000\n1 是 shì\n的\t12\n\n中国\n", encoding="utf-8")
+    assert read_frequency_list(str(path)) == {"的": 0, "是": 1, "中国": 2}
+
+
+def build(path, entries, frequency):
+    conn = sqlite3.connect(str(path))
+    create_table(conn.cursor())
+    insert_entries(conn.cursor(), entries, 0, frequency)
+    for create_index in INDEXES:
+        create_index(conn.cursor())
+    write_metadata(conn.cursor(), {"version": "1"})
+    conn.commit()
+    return conn
+
+
+def test_materialize(tmp_path):
+    entries = [("中國", "中国", "zhōng guó", ("China",)), ("好", "好", "hǎo", ("good", "well")), ("啊", "啊", "a", ())]
+    conn = build(tmp_path / "built.db", entries, {"好": 0})
+    write_dump(conn, str(tmp_path / "dump.xz"))
+
+    db_path = str(tmp_path / "dictionary.db")
+    assert materialize(str(tmp_path / "dump.xz"), db_path, True, lambda *progress: None)
+    assert (tmp_path / "dictionary.bin").exists()
+    assert list(dump_lines(sqlite3.connect(db_path))) == list(dump_lines(conn))
+    assert not materialize(str(tmp_path / "dump.xz"), db_path, True, lambda *progress: None)
+
+
+def test_segment_mixed_script(tmp_path):
+    entries = [("T恤", "T恤", "T xù", ("T-shirt",)), ("卡拉OK", "卡拉OK", "kǎ lā O K", ("karaoke",)), ("好", "好", "hǎo", ("good",))]
+    build(tmp_path / "dictionary.db", entries, {}).close()
+    engine = DictionaryEngine(str(tmp_path / "dictionary.db"))
+    assert engine.segment("T恤很好，卡拉OK x/A好") == ["T恤", "很", "好", "卡拉OK", "好"]
+
+
+def test_toneless_english_queries(tmp_path):
+    entries = [
+        ("人", "人", "rén", ("man", "person")),
+        ("滿", "满", "mǎn", ("full",)),
+        ("慢", "慢", "màn", ("slow",)),
+        ("哦呢", "哦呢", "ò ne", ("(made up)",)),
+        ("一", "一", "yī", ("one",)),
+        ("你好", "你好", "nǐ hǎo", ("hello",)),
+    ]
+    build(tmp_path / "dictionary.db", entries, {"满": 0, "慢": 1, "人": 2}).close()
+    write_binary(sqlite3.connect(str(tmp_path / "dictionary.db")), str(tmp_path / "dictionary.bin"))
+    for engine in [DictionaryEngine(str(tmp_path / "dictionary.db")), BinaryEngine(str(tmp_path / "dictionary.bin"))]:
+        # Toneless words that are an English sense are not searched in pinyin, even if they rank higher there
+        assert [row[1] for row in engine.fuzzy("man")] == ["人"]
+        assert [row[1] for row in engine.fuzzy("one")] == ["一"]
+        assert [row[1] for row in engine.fuzzy("man4")] == ["慢"]
+        assert [row[1] for row in engine.fuzzy("màn")] == ["慢"]
+        assert [row[1] for row in engine.fuzzy("nihao")] == ["你好"]
+        assert [row[1] for row in engine.batch(["man", "o ne"], True)[0]] == ["人", "哦呢"]
+
+
+def test_binary_parity(tmp_path):
+    entries = [
+        ("好", "好", "hǎo", ("good", "well")),
+        ("好", "好", "hào", ("to be fond of",)),
+        ("你好", "你好", "nǐ hǎo", ("hello", "hi")),
+        ("好人", "好人", "hǎo rén", ("good person",)),
+        ("好像", "好像", "hǎo xiàng", ("as if", "to seem like")),
+        ("友好", "友好", "yǒu hǎo", ("friendly", "good")),
+        ("美好", "美好", "měi hǎo", ("good",)),
+        ("學好", "学好", "xué hǎo", ("to learn well",)),
+        ("人", "人", "rén", ("person", "people")),
+        ("中國人", "中国人", "Zhōng guó rén", ("Chinese person",)),
+    ]
+    conn = build(tmp_path / "dictionary.db", entries, {"好": 0, "人": 1, "你好": 2})
+    write_binary(conn, str(tmp_path / "dictionary.bin"))
+    sqlite_engine = DictionaryEngine(str(tmp_path / "dictionary.db"))
+    binary_engine = BinaryEngine(str(tmp_path / "dictionary.bin"))
+    for word in ["好", "好*", "好人*", "學好", "学", "國人", "中国人", "hao", "hao3", "hǎo rén", "good", "person", "nothing"]:
+        for exact in [True, False]:
+            assert binary_engine.lookup(word, exact) == sqlite_engine.lookup(word, exact)
+            pages = {}
+            for engine in [sqlite_engine, binary_engine]:
+                rows, cursor = engine.match(word, exact, 2)
+                pages[engine] = [rows]
+                while cursor is not None:
+                    rows, cursor = engine.match(word, exact, 2, cursor)
+                    pages[engine].append(rows)
+            assert pages[binary_engine] == pages[sqlite_engine]
+    assert binary_engine.batch(["好", "good", "nothing"], False) == sqlite_engine.batch(["好", "good", "nothing"], False)
+    assert binary_engine.headwords(["好", "学好", "中國人", "無"]) == sqlite_engine.headwords(["好", "学好", "中國人", "無"])
+
+
+RELEASE_HEADER = "# CC-CEDICT\n#! version=1\n#! subversion=0\n#! format=ts\n#! charset=UTF-8\n#! date={}\n"
+
+
+def run_database_tool(directory, release, *args):
+    (directory / "cedict_ts.u8").write_text(release, encoding="utf8")
+    (directory / "frequency.txt").write_text("好\n人\n你好\n", encoding="utf8")
+    tool = join(dirname(dirname(abspath(__file__))), "tools", "database.py")
+    subprocess.run([sys.executable, tool, "cedict_ts.u8", *args], cwd=str(directory), check=True, stdout=subprocess.DEVNULL)
+
+
+def database_contents(path):
+    # Each table with row ids replaced by the entries, which differ between updated and rebuilt databases
+    conn = sqlite3.connect(str(path))
+    entries = {}
+    for rowid, *entry in conn.execute("SELECT rowid, hanzi_trad, hanzi_simp, pinyin, eng, rank FROM dictionary"):
+        senses = tuple(conn.execute("SELECT ordinal, text, tokens FROM senses WHERE id = ? ORDER BY ordinal", (rowid,)))
+        entries[rowid] = (*entry, senses)
+    return {
+        "dictionary": Counter(entries.values()),
+        "hanzi_grams": Counter((gram, rank, entries[id]) for gram, rank, id in conn.execute("SELECT gram, rank, id FROM hanzi_grams")),
+        "pinyin_keys": Counter((key, rank, entries[id]) for key, rank, id in conn.execute("SELECT key, rank, id FROM pinyin_keys")),
+        "sense_tokens": Counter((token, entries[id], ordinal) for token, id, ordinal in conn.execute("SELECT token, id, ordinal FROM sense_tokens")),
+        "sample_pool": Counter(entries[id] for id, in conn.execute("SELECT id FROM sample_pool")),
+        "frequency": list(conn.execute("SELECT word, pos FROM frequency ORDER BY pos")),
+        "metadata": dict(conn.execute("SELECT key, value FROM metadata")),
+    }
+
+
+def test_update_database(tmp_path):
+    old = RELEASE_HEADER.format("2024-01-01") + (
+        "你好 你好 [ni3 hao3] /hello/hi/\n"
+        "你 你 [ni3] /you/\n"
+        "好 好 [hao3] /good/well/\n"
+        "好 好 [hao3] /(duplicate)/\n"
+        "人 人 [ren2] /person/\n"
+        "中國 中国 [Zhong1 guo2] /China/\n"
+    )
+    # Deletes 你 and the first 好 [hao3], so the second one takes its key, changes 人 and inserts 好人 and 好 [hao4]
+    new = RELEASE_HEADER.format("2024-02-01") + (
+        "你好 你好 [ni3 hao3] /hello/hi/\n"
+        "好 好 [hao3] /(duplicate)/\n"
+        "好 好 [hao4] /to be fond of/\n"
+        "人 人 [ren2] /person/people/\n"
+        "好人 好人 [hao3 ren2] /good person/\n"
+        "中國 中国 [Zhong1 guo2] /China/\n"
+    )
+    (tmp_path / "updated").mkdir()
+    (tmp_path / "rebuilt").mkdir()
+    run_database_tool(tmp_path / "updated", old, "--frequency", "frequency.txt")
+    run_database_tool(tmp_path / "updated", new, "--update")
+    run_database_tool(tmp_path / "rebuilt", new, "--frequency", "frequency.txt")
+
+    updated = database_contents(tmp_path / "updated" / "CC-CEDICT_dictionary.db")
+    assert updated == database_contents(tmp_path / "rebuilt" / "CC-CEDICT_dictionary.db")
+    assert len(updated["dictionary"]) == 6 and updated["metadata"]["date"] == "2024-02-01"
+
+
+def test_identify(monkeypatch):
+    strings = ["說", "说", "人", "人說", "人说", "说說", "abc", "", "說abc"]
+    identities = [hanzidentifier.TRAD, hanzidentifier.SIMP, hanzidentifier.BOTH, hanzidentifier.TRAD, hanzidentifier.SIMP]
+    identities += [hanzidentifier.MIXED, hanzidentifier.UNKNOWN, hanzidentifier.UNKNOWN, hanzidentifier.TRAD]
+    assert [hanzidentifier.identify(s) for s in strings] == identities
+    assert hanzidentifier.identify_many(strings) == identities
+
+    # Characters of CC-CEDICT that are neither traditional nor simplified are not compatible with either
+    monkeypatch.setattr(hanzidentifier.cedict, "all", hanzidentifier.cedict.all + "\U00020000")
+    monkeypatch.setattr(hanzidentifier, "_flags", None)
+    strings = ["\U00020000", "人\U00020000", "說\U00020000", "abc\U00020000"]
+    assert [hanzidentifier.identify(s) for s in strings] == [hanzidentifier.MIXED] * 4
+    assert hanzidentifier.identify_many(strings) == [hanzidentifier.MIXED] * 4
+    assert hanzidentifier.has_chinese("\U00020000") and not hanzidentifier.is_traditional("\U00020000")
+
+
+def test_histogram():
+    histogram = Histogram()
+    for ms in [0.5, 3, 3, 4, 150, 2000]:
+        histogram.add(ms)
+    assert histogram.count == 6
+    assert histogram.buckets == [1, 0, 3, 0, 0, 0, 0, 1, 0, 0, 1]
+    assert histogram.percentile(0.5) == 5
+    assert histogram.percentile(1) == 2000
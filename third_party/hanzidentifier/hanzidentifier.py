@@ -2,8 +2,6 @@
 """Python module that identifies Chinese text as Simplified or Traditional."""
 
 from __future__ import unicode_literals
-import re
-
 import sys
 import os.path
 
@@ -16,15 +14,50 @@ SIMP = SIMPLIFIED = 2
 BOTH = 3
 MIXED = 4
 
-_TRADITIONAL_CHARACTERS = set(list(cedict.traditional))
-_SIMPLIFIED_CHARACTERS = set(list(cedict.simplified))
-_SHARED_CHARACTERS = _TRADITIONAL_CHARACTERS.intersection(_SIMPLIFIED_CHARACTERS)
-_ALL_CHARACTERS = cedict.all
+# Flags of each codepoint in the lookup table. Characters found in CC-CEDICT
+# have at least one flag set, _OTHER marks those that are neither Traditional
+# nor Simplified.
+_TRAD_FLAG = 1
+_SIMP_FLAG = 2
+_OTHER_FLAG = 4
+
+_flags = None
+
+
+def _get_flags():
+    """Return the codepoint flags table, building it on first use."""
+    global _flags
+    if _flags is None:
+        flags = bytearray(max(ord(c) for c in cedict.all) + 1)
+        for c in cedict.all:
+            flags[ord(c)] = _OTHER_FLAG
+        for c in cedict.traditional:
+            flags[ord(c)] = _TRAD_FLAG
+        for c in cedict.simplified:
+            flags[ord(c)] = flags[ord(c)] & _TRAD_FLAG | _SIMP_FLAG
+        _flags = flags
+    return _flags
 
 
 def _get_hanzi(s):
     """Extract a string's Chinese characters."""
-    return set(re.sub("[^%s]" % _ALL_CHARACTERS, "", s))
+    flags = _get_flags()
+    size = len(flags)
+    return set(c for c in s if ord(c) < size and flags[ord(c)])
+
+
+def _identify(s, flags, size):
+    """Combine the flags of a string's characters into its identity."""
+    found = False
+    common = _TRAD_FLAG | _SIMP_FLAG
+    for c in set(s):
+        code = ord(c)
+        if code < size and flags[code]:
+            found = True
+            common &= flags[code]
+    if not found:
+        return UNKNOWN
+    return (MIXED, TRADITIONAL, SIMPLIFIED, BOTH)[common]
 
 
 def identify(s):
@@ -49,16 +82,21 @@ def identify(s):
     :func:`has_chinese` are provided.
 
     """
-    chinese = _get_hanzi(s)
-    if not chinese:
-        return UNKNOWN
-    if chinese.issubset(_SHARED_CHARACTERS):
-        return BOTH
-    if chinese.issubset(_TRADITIONAL_CHARACTERS):
-        return TRADITIONAL
-    if chinese.issubset(_SIMPLIFIED_CHARACTERS):
-        return SIMPLIFIED
-    return MIXED
+    flags = _get_flags()
+    return _identify(s, flags, len(flags))
+
+
+def identify_many(strings):
+    """Identify the Chinese characters of many strings at once.
+
+    *strings* is an iterable of strings. Returns a list with the identity of
+    each string, as returned by :func:`identify`. Each string is classified
+    with one pass over its characters in the codepoint table.
+
+    """
+    flags = _get_flags()
+    size = len(flags)
+    return [_identify(s, flags, size) for s in strings]
 
 
 def has_chinese(s):
@@ -78,14 +116,7 @@ def is_traditional(s):
         >>> identify('foo') in (TRADITIONAL, BOTH)
 
     """
-    chinese = _get_hanzi(s)
-    if not chinese:
-        return False
-    elif chinese.issubset(_SHARED_CHARACTERS):
-        return True
-    elif chinese.issubset(_TRADITIONAL_CHARACTERS):
-        return True
-    return False
+    return identify(s) in (TRADITIONAL, BOTH)
 
 
 def is_simplified(s):
@@ -95,11 +126,4 @@ def is_simplified(s):
         >>> identify('foo') in (SIMPLIFIED, BOTH)
 
     """
-    chinese = _get_hanzi(s)
-    if not chinese:
-        return False
-    elif chinese.issubset(_SHARED_CHARACTERS):
-        return True
-    elif chinese.issubset(_SIMPLIFIED_CHARACTERS):
-        return True
-    return False
+    return identify(s) in (SIMPLIFIED, BOTH)
@@ -1,10 +1,15 @@
 import zipfile
 import os
+import sys
+import sqlite3
 from pathlib import Path
 import shutil
 
 root = Path(__file__).parents[1]
 
+sys.path.insert(0, str(root))
+from cedict.dump import write_dump
+
 # create output folder
 if not os.path.exists(f"{root}/releases"):
     os.makedirs(f"{root}/releases")
@@ -13,6 +18,13 @@ if not os.path.exists(f"{root}/releases"):
 shutil.rmtree(f"{root}/forms/__pycache__", ignore_errors=True)
 shutil.rmtree(f"{root}/cedict/__pycache__", ignore_errors=True)
 
+# The dictionary ships as a compressed dump of the database built by database.py, the add-on materializes the
+# database and the binary dictionary from it on first use. The dump is kept out of the add-on folder, where it
+# would replace the database that was built
+conn = sqlite3.connect(f"{root}/CC-CEDICT_dictionary.db")
+write_dump(conn, f"{root}/releases/CC-CEDICT_dictionary.dump.xz")
+conn.close()
+
 # create .ankiaddon
 
 data = [
@@ -30,7 +42,7 @@ data = [
     f"{root}/cedict",
     f"{root}/third_party",
     f"{root}/designer",
-    f"{root}/CC-CEDICT_dictionary.db",
+    f"{root}/releases/CC-CEDICT_dictionary.dump.xz",
 ]
 
 zipfile.main(data)
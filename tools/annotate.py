@@ -0,0 +1,21 @@
+"""
+Annotate a Chinese text corpus with CC-CEDICT entries outside of Anki, for example subtitles or graded readers
+before importing them. The text is segmented into dictionary words and written as TSV or JSON lines.
+
+    python tools/annotate.py corpus.txt --format jsonl --output corpus.jsonl
+"""
+
+import sys
+import types
+
+from os.path import dirname, realpath
+
+# Import the add-on folder as a package without running its __init__.py, which needs Anki
+addon = types.ModuleType("cedict_addon")
+addon.__path__ = [dirname(dirname(realpath(__file__)))]
+sys.modules["cedict_addon"] = addon
+
+from cedict_addon.cedict.annotate import main  # noqa: E402
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
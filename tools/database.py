@@ -1,63 +1,290 @@
 import sqlite3
 import re
-import traceback
+import argparse
+import os
+import sys
+import hashlib
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+
 from mafan import pinyin
-import time
 from progressbar import *
-import sys
 
-conn = sqlite3.connect("CC-CEDICT_dictionary.db")
-c = conn.cursor()
+# The schema is shared with the add-on, which builds the same database from its dump on first use. Senses and
+# pinyin are normalized the same way the add-on normalizes queries
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cedict.binary import write_binary
+from cedict.lookup import entry_rank
+from cedict.schema import (
+    INDEXES,
+    Entry,
+    create_sample_pool,
+    create_table,
+    entry_grams,
+    entry_pinyin_keys,
+    insert_entries,
+    sense_rows,
+    tune_for_bulk_load,
+    write_metadata,
+)
+from cedict.wordlist import read_frequency_list
 
+# Lines handed to a parser process at a time
+CHUNK_LINES = 5000
 
-def create_table():
-    c.execute("CREATE TABLE IF NOT EXISTS dictionary(hanzi_trad TEXT, hanzi_simp TEXT, pinyin TEXT, eng TEXT)")
+DATABASE = "CC-CEDICT_dictionary.db"
 
+pinyin_pattern = re.compile(r"[^[]*\[([^]]*)\]")
+bracket_pattern = re.compile(r"\[[^\]\r\n]*\]")
 
-def data_entry(hanzi_trad, hanzi_simp, p, eng):
-    c.execute("INSERT INTO dictionary (hanzi_trad, hanzi_simp, pinyin , eng) VALUES(?, ?, ?, ?)", (hanzi_trad, hanzi_simp, p, eng))
+# Syllables repeat across the whole file, decode each one only once per process
+decode = lru_cache(maxsize=None)(pinyin.decode)
 
+# Position of each word in the frequency list the ranks are computed with, see load_frequency
+frequency: Dict[str, int] = {}
 
-def txt_to_database(fname):
-    counter = 0
-    total = 0
 
+def load_frequency(fname: Optional[str]):
+    """
+    Read the frequency list the ranks are computed with and keep it in the database. Without a file name, the
+    list kept by the last build or update is used.
+    """
+    global frequency
+    if fname is None:
+        frequency = dict(c.execute("SELECT word, pos FROM frequency"))
+        return
+    frequency = read_frequency_list(fname)
+    c.execute("DELETE FROM frequency")
+    c.executemany("INSERT INTO frequency (word, pos) VALUES(?, ?)", frequency.items())
+
+
+def keep_frequency(fname: str):
+    """
+    Copy the frequency list of the database a rebuild replaces, for a rebuild without a frequency list.
+    """
+    c.execute("ATTACH DATABASE ? AS previous", (fname,))
+    if c.execute("SELECT 1 FROM previous.sqlite_master WHERE name = 'frequency'").fetchone():
+        c.execute("INSERT INTO frequency (word, pos) SELECT word, pos FROM previous.frequency")
+    conn.commit()
+    c.execute("DETACH DATABASE previous")
+
+
+def rerank_entries() -> int:
+    """
+    Recompute the rank of every entry, for changed senses or a new frequency list, and move the gram and pinyin
+    index rows of the entries whose rank changed.
+
+    :return: the number of entries whose rank changed
+    """
+    sense_counts = dict(c.execute("SELECT id, COUNT(*) FROM senses GROUP BY id"))
+    changed = 0
+    for rowid, rank, hanzi_trad, hanzi_simp, p in c.execute("SELECT rowid, rank, hanzi_trad, hanzi_simp, pinyin FROM dictionary").fetchall():
+        new_rank = entry_rank(hanzi_trad, hanzi_simp, sense_counts.get(rowid, 0), frequency)
+        if new_rank == rank:
+            continue
+        changed += 1
+        c.execute("UPDATE dictionary SET rank = ? WHERE rowid = ?", (new_rank, rowid))
+        c.executemany("DELETE FROM hanzi_grams WHERE gram = ? AND rank = ? AND id = ?", entry_grams(rowid, rank, hanzi_trad, hanzi_simp))
+        c.executemany("INSERT INTO hanzi_grams (gram, rank, id) VALUES(?, ?, ?)", entry_grams(rowid, new_rank, hanzi_trad, hanzi_simp))
+        c.executemany("DELETE FROM pinyin_keys WHERE key = ? AND rank = ? AND id = ?", entry_pinyin_keys(rowid, rank, p))
+        c.executemany("INSERT INTO pinyin_keys (key, rank, id) VALUES(?, ?, ?)", entry_pinyin_keys(rowid, new_rank, p))
+    return changed
+
+
+def read_release_info(fname: str) -> Dict[str, str]:
+    """
+    Read the "#! key=value" lines from the header of a CC-CEDICT release, e.g. version, subversion and date.
+    """
+    info = {}
     with open(fname, encoding="utf8") as f:
         for line in f:
-            total += 1
+            if not line.startswith("#"):
+                break
+            if line.startswith("#!") and "=" in line:
+                key, value = line[2:].strip().split("=", 1)
+                info[key.strip()] = value.strip()
+    return info
+
+
+def parse_line(line: str) -> Optional[Entry]:
+    """
+    Parse a CC-CEDICT line into traditional, simplified, pinyin with tone marks and the separate senses.
+    Returns None for comments and blank lines.
+    """
+    if not line or line.startswith("#"):
+        return None
+    datalist = line.split(" ")
+    hanzi_trad = datalist[0]
+    hanzi_simp = datalist[1]
+    p = pinyin_pattern.match(line).groups()[0]
+    pinyin_string = " ".join(decode(i) for i in p.split(" "))
+    senses = tuple(bracket_pattern.sub(lambda m: "(" + decode(m.group()) + ")", sense) for sense in line.rstrip("\n").split("/")[1:] if sense.strip())
+    return hanzi_trad, hanzi_simp, pinyin_string, senses
+
+
+def replace_senses(rowid: int, old_senses: Tuple[str, ...], new_senses: Tuple[str, ...]):
+    old_rows, old_tokens = [], []
+    sense_rows(rowid, old_senses, old_rows, old_tokens)
+    c.executemany("DELETE FROM sense_tokens WHERE token = ? AND id = ? AND ordinal = ?", old_tokens)
+    c.execute("DELETE FROM senses WHERE id = ?", (rowid,))
+    new_rows, new_tokens = [], []
+    sense_rows(rowid, new_senses, new_rows, new_tokens)
+    c.executemany("INSERT INTO senses (id, ordinal, text, tokens) VALUES(?, ?, ?, ?)", new_rows)
+    c.executemany("INSERT INTO sense_tokens (token, id, ordinal) VALUES(?, ?, ?)", new_tokens)
+
+
+def parse_chunk(lines: List[bytes]) -> Tuple[int, List[Entry]]:
+    """
+    Parse a chunk of raw lines in a worker process.
+
+    :return: the size of the chunk in bytes, for the progress bar, and the parsed entries
+    """
+    entries = [entry for line in lines if (entry := parse_line(line.decode("utf8").rstrip("\r\n")))]
+    return sum(len(line) for line in lines), entries
 
-    bar = ProgressBar(maxval=total)
+
+def read_chunks(fname: str) -> Iterator[List[bytes]]:
+    with open(fname, "rb") as f:
+        while True:
+            lines = [line for _, line in zip(range(CHUNK_LINES), f)]
+            if not lines:
+                return
+            yield lines
+
+
+def txt_to_database(fname):
+    bar = ProgressBar(maxval=os.path.getsize(fname))
     bar.start()
+    done = 0
 
-    with open(fname, encoding="utf8") as f:
-        for line in f:
-            bar.update(counter)
-            counter = counter + 1
-            datalist = line.split(" ")
-            hanzi_trad = datalist[0]
-            hanzi_simp = datalist[1]
-            p = re.match(r"[^[]*\[([^]]*)\]", line).groups()[0]
-            p = p.split(" ")
-            pinyin_string = ""
-            for i in p:
-                pinyin_string = f"{pinyin_string} {pinyin.decode(i)}" if pinyin_string else f"{pinyin_string}{pinyin.decode(i)}"
-            eng = line.split("/", 1)[1]
-            eng = eng.replace("/", ", ")
-            regexp_pattern = "\[[^\]\r\n]*\]"
-            st = eng
-            a = re.findall(regexp_pattern, st)
-            for i in a:
-                eng = eng.replace(i, "(" + pinyin.decode(i) + ")")
-            eng = eng.rstrip(", \n")
-            data_entry(hanzi_trad, hanzi_simp, pinyin_string, eng)
+    # Chunks are parsed in parallel and inserted in file order, so row ids follow the file
+    rowid = c.execute("SELECT COALESCE(MAX(rowid), 0) FROM dictionary").fetchone()[0]
+    with Pool() as pool:
+        for size, entries in pool.imap(parse_chunk, read_chunks(fname)):
+            rowid = insert_entries(c, entries, rowid, frequency)
+            done += size
+            bar.update(done)
 
     bar.finish()
 
 
-if len(sys.argv) != 2:
-    print("No file name provided. Run database.py filename.txt")
-    quit()
-fname = sys.argv[1:]
-create_table()
-txt_to_database(fname[0])
-conn.commit()
+def entry_key(entry: Entry, seen: Dict[Tuple[str, str, str], int]) -> Tuple[str, str, str, int]:
+    """
+    Identify an entry across releases by its headwords and pinyin. Entries sharing all three are told apart by
+    the order they appear in.
+    """
+    key = entry[:3]
+    seen[key] = seen.get(key, 0) + 1
+    return (*key, seen[key])
+
+
+def entry_hash(entry: Entry) -> bytes:
+    return hashlib.blake2b("\x1f".join((*entry[:3], *entry[3])).encode("utf8"), digest_size=16).digest()
+
+
+def update_database(fname):
+    """
+    Apply a new CC-CEDICT release to the existing database. Entries are matched by entry_key and compared by
+    hash, then only the inserted, changed and deleted entries are written, together with their rows in the
+    n-gram, pinyin and sense indexes. Entries whose rank changed are moved in the ranked indexes.
+    """
+    # Databases built before English lookups moved to the sense index still have a full-text index nothing reads
+    c.execute("DROP TABLE IF EXISTS dictionary_fts")
+    senses: Dict[int, List[str]] = {}
+    for rowid, text in c.execute("SELECT id, text FROM senses ORDER BY id, ordinal"):
+        senses.setdefault(rowid, []).append(text)
+    old: Dict[Tuple[str, str, str, int], Tuple[int, bytes, Entry]] = {}
+    ranks: Dict[int, int] = {}
+    seen = {}
+    for rowid, hanzi_trad, hanzi_simp, p, rank in c.execute(
+        "SELECT rowid, hanzi_trad, hanzi_simp, pinyin, rank FROM dictionary ORDER BY rowid"
+    ).fetchall():
+        entry = (hanzi_trad, hanzi_simp, p, tuple(senses.get(rowid, ())))
+        old[entry_key(entry, seen)] = (rowid, entry_hash(entry), entry)
+        ranks[rowid] = rank
+
+    new: Dict[Tuple[str, str, str, int], Entry] = {}
+    seen = {}
+    with Pool() as pool:
+        for _, entries in pool.imap(parse_chunk, read_chunks(fname)):
+            for entry in entries:
+                new[entry_key(entry, seen)] = entry
+
+    deleted = [(rowid, entry) for key, (rowid, _, entry) in old.items() if key not in new]
+    updated = [(old[key][0], old[key][2], entry) for key, entry in new.items() if key in old and old[key][1] != entry_hash(entry)]
+    inserted = [entry for key, entry in new.items() if key not in old]
+
+    for rowid, (hanzi_trad, hanzi_simp, p, entry_senses) in deleted:
+        c.executemany("DELETE FROM hanzi_grams WHERE gram = ? AND rank = ? AND id = ?", entry_grams(rowid, ranks[rowid], hanzi_trad, hanzi_simp))
+        c.executemany("DELETE FROM pinyin_keys WHERE key = ? AND rank = ? AND id = ?", entry_pinyin_keys(rowid, ranks[rowid], p))
+        replace_senses(rowid, entry_senses, ())
+        c.execute("DELETE FROM dictionary WHERE rowid = ?", (rowid,))
+
+    # Matching keys means only the senses changed, their new ranks are set by rerank_entries
+    for rowid, old_entry, entry in updated:
+        c.execute("UPDATE dictionary SET eng = ? WHERE rowid = ?", (", ".join(entry[3]), rowid))
+        replace_senses(rowid, old_entry[3], entry[3])
+
+    # New entries get row ids after all existing ones
+    last = c.execute("SELECT COALESCE(MAX(rowid), 0) FROM dictionary").fetchone()[0]
+    insert_entries(c, inserted, last, frequency)
+    for rowid, (hanzi_trad, hanzi_simp, p, entry_senses) in enumerate(inserted, last + 1):
+        rank = entry_rank(hanzi_trad, hanzi_simp, len(entry_senses), frequency)
+        c.executemany("INSERT INTO hanzi_grams (gram, rank, id) VALUES(?, ?, ?)", entry_grams(rowid, rank, hanzi_trad, hanzi_simp))
+        c.executemany("INSERT INTO pinyin_keys (key, rank, id) VALUES(?, ?, ?)", entry_pinyin_keys(rowid, rank, p))
+
+    reranked = rerank_entries()
+    create_sample_pool(c)
+    print(f"Inserted {len(inserted)}, updated {len(updated)} and deleted {len(deleted)} entries, reranked {reranked} entries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the CC-CEDICT dictionary database, or update it to a new release.")
+    parser.add_argument("fname", help="a CC-CEDICT release, e.g. cedict_ts.u8")
+    parser.add_argument("--update", action="store_true", help="apply the release to the existing database instead of rebuilding it")
+    parser.add_argument(
+        "--frequency",
+        help="a word frequency list, most frequent word first, to rank listed words above others of the same length "
+        "(default: the list of the last build or update)",
+    )
+    args = parser.parse_args()
+    if args.update:
+        if not os.path.exists(DATABASE):
+            print(f"{DATABASE} not found, build it first with database.py filename.txt")
+            quit()
+        conn = sqlite3.connect(DATABASE)
+        c = conn.cursor()
+        if "rank" not in [column[1] for column in c.execute("PRAGMA table_info(dictionary)")]:
+            print(f"{DATABASE} has no ranks, rebuild it with database.py filename.txt")
+            quit()
+        # All changes are applied in one transaction. It is begun explicitly, sqlite3 only begins one before the
+        # first INSERT, UPDATE or DELETE and would commit dropping the full-text index on its own
+        with conn:
+            c.execute("BEGIN")
+            load_frequency(args.frequency)
+            update_database(args.fname)
+            write_metadata(c, read_release_info(args.fname))
+    else:
+        # Built into a new file that replaces the database once complete, so an existing database is neither
+        # appended to nor lost when the build fails
+        temp = DATABASE + ".tmp"
+        if os.path.exists(temp):
+            os.remove(temp)
+        conn = sqlite3.connect(temp)
+        c = conn.cursor()
+        tune_for_bulk_load(c)
+        create_table(c)
+        if args.frequency is None and os.path.exists(DATABASE):
+            keep_frequency(DATABASE)
+        load_frequency(args.frequency)
+        txt_to_database(args.fname)
+        for create_index in INDEXES:
+            create_index(c)
+        write_metadata(c, read_release_info(args.fname))
+        conn.commit()
+        conn.close()
+        os.replace(temp, DATABASE)
+        conn = sqlite3.connect(DATABASE)
+    # The memory-mapped copy for the binary backend is always rewritten from the database
+    write_binary(conn, "CC-CEDICT_dictionary.bin")